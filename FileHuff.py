@@ -1,12 +1,109 @@
 # -*- coding: utf-8 -*-
+import argparse
+import array
+import bisect
+import heapq
+import io
+import math
 import os
+import re
 import six
+import struct
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 import sys
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from HuffmanUIfile import Ui_Form
 import time
 
+try:
+    import numpy
+except ImportError:
+    # 没装 numpy 就用标准库统计频率 用纯 Python 编码
+    numpy = None
+
+# 统计频率时每次处理的字节数
+FREQ_CHUNK_SIZE = 1 << 22
+
+# 解码查找表的最大位数 (表有 2**DECODE_TABLE_BITS 项)
+DECODE_TABLE_BITS = 16
+
+# 一次查表解出多个字符时表的位数 编码普遍很短时 (平均每次能解出2个以上字符) 自动使用
+MULTI_TABLE_BITS = 12
+
+# 4路同步多字符查表时 每次连续解的轮数少于这个数就一路一路地解完剩下的
+INTERLEAVE_MIN_ROUNDS = 64
+
+# 压缩时默认每次读取的字节数
+READ_CHUNK_SIZE = 1 << 20
+
+# 分块压缩时默认每块的字节数 为0时不分块
+BLOCK_SIZE = 1 << 20
+
+# 分块压缩时默认的进程数
+WORKERS = os.cpu_count() or 1
+
+# 默认的最大编码长度 0表示不限制 限制在 DECODE_TABLE_BITS 以内时解码只用一张表
+MAX_CODE_LENGTH = 0
+
+# 默认每块的编码路数 1 或 4
+STREAMS = 1
+
+# 编码时输出缓冲的字节数 (8的倍数) 缓冲满了才写一次文件
+ENCODE_CHUNK_SIZE = 1 << 16
+
+# 用 numpy 编码时每次处理的字节数 限制临时数组的大小
+NUMPY_ENCODE_SIZE = 1 << 20
+
+# 解码时输出缓冲的字节数 缓冲满了才写一次文件
+DECODE_CHUNK_SIZE = 1 << 20
+
+# 每字节的熵 (位) 不低于这个值时哈弗曼编码最多省1%左右 直接存原数据
+STORED_ENTROPY = 7.9
+
+# 默认是否在哈弗曼编码之前先做游程编码
+RLE = False
+
+# 不分块压缩时默认采样统计频率的字节数 0表示统计整个文件
+SAMPLE_SIZE = 0
+
+# 采样时每次连续读取的字节数
+SAMPLE_CHUNK_SIZE = 1 << 16
+
+# 游程编码: 连续4个相同的字节后面跟1个字节的重复次数 (再重复0到255次)
+RUN_PATTERN = re.compile(br'(.)\1{3,258}', re.DOTALL)
+RUN_DECODE_PATTERN = re.compile(br'(.)\1{3}(.)', re.DOTALL)
+
+# 压缩文件开头的标记 后面跟1个字节的版本号 旧格式没有标记 (版本号记为0)
+FILE_MAGIC = b'\xffHUF'
+FORMAT_LEGACY = 0
+# 范式哈弗曼 头部只存每个字符的编码长度
+FORMAT_CANONICAL = 1
+# 分块 每块有自己的编码长度表 可以多进程同时压缩
+# 文件末尾是块索引 记录每块在压缩文件和原文件中的位置 可以多进程同时解压
+FORMAT_BLOCKS = 2
+# 分块 头部多记录1个字节的最大编码长度 (0表示不限制)
+FORMAT_LIMITED = 3
+# 分块 头部再多记录1个字节的编码路数 (1或4) 4路时每块的编码分成4路交错解码
+FORMAT_STREAMS = 4
+# 分块 每块的原始字节数后面多1个字节的存储方式 压缩不了的块直接存原数据
+FORMAT_STORED = 5
+# 分块 存储方式多了只有一种字符的块和先做游程编码的块
+FORMAT_RUNS = 6
+# 分块 文件大小 块大小 每块里的各个字节数都是变长整数 块索引每项8字节 可以压缩4GB以上的文件
+FORMAT_VARINT = 7
+# 不分块的范式哈弗曼 文件大小是变长整数
+FORMAT_CANONICAL_VARINT = 8
+# 所有分块格式的版本号
+BLOCK_FORMATS = (FORMAT_BLOCKS, FORMAT_LIMITED, FORMAT_STREAMS, FORMAT_STORED, FORMAT_RUNS, FORMAT_VARINT)
+
+# 块的存储方式: 哈弗曼编码 / 原数据 / 只有一种字符 (只存这个字符) / 游程编码后再哈弗曼编码
+BLOCK_HUFFMAN = 0
+BLOCK_STORED = 1
+BLOCK_CONSTANT = 2
+BLOCK_RLE = 3
+
 
 class LeafNode(object):
     """
@@ -123,9 +220,46 @@ class Work(object):
     干活的类
     """
 
-    def __init__(self, input_file, output_file):
+    def __init__(self, input_file, output_file, chunk_size=READ_CHUNK_SIZE, block_size=BLOCK_SIZE,
+                 workers=WORKERS, max_code_length=MAX_CODE_LENGTH, streams=STREAMS, rle=RLE,
+                 sample=SAMPLE_SIZE):
         self.input_file = input_file
         self.output_file = output_file
+        # 压缩时每次从输入文件读取的字节数 内存占用只和它有关 和文件大小无关
+        self.chunk_size = chunk_size
+        # 分块压缩每块的字节数 为0时写不分块的范式哈弗曼格式
+        self.block_size = block_size
+        # 同时压缩的进程数
+        self.workers = workers
+        # 最大编码长度 256个字符至少要8位
+        if 0 < max_code_length < 8:
+            raise ValueError("最大编码长度不能小于8")
+        self.max_code_length = max_code_length
+        # 每块的编码路数
+        if streams not in (1, 4):
+            raise ValueError("编码路数只能是1或4")
+        self.streams = streams
+        # 分块格式的版本号 决定每块里有哪些信息 压缩时写最新的版本 解压时由文件头决定
+        self.block_version = FORMAT_VARINT
+        # 分块压缩时是否先试一下游程编码
+        self.rle = rle
+        # 不分块压缩时只采样这么多字节统计频率 文件只读一遍
+        if sample > 0 and block_size > 0:
+            raise ValueError("只有不分块压缩 (block_size 为0) 时才能采样")
+        self.sample = sample
+
+    def read_chunks(self):
+        """
+        按 chunk_size 一块一块读取输入文件
+        :return: 数据块的生成器
+        """
+        f = open(self.input_file, 'rb')
+        while True:
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        f.close()
 
     def build_haffuman_tree(self, haffuman_dict):
         """
@@ -133,36 +267,79 @@ class Work(object):
         :param haffuman_dict:
         :return: 哈弗曼树
         """
-        tmp_list = []
+        # 用小顶堆代替每次合并都重新排序 (权重, 序号, 树)
+        # 序号保证权重相同时的顺序确定: 叶子按字典顺序在前 新合并的树按生成顺序在后
+        # 这和原来稳定排序+追加到末尾的结果完全一样 所以压缩和解压两边得到的树一模一样
+        tmp_heap = []
+        order = 0
         for x in haffuman_dict.keys():
             tmp = Haffuman(0, x, haffuman_dict[x])
-            tmp_list.append(tmp)
+            tmp_heap.append((tmp.get_freq(), order, tmp))
+            order = order + 1
+        heapq.heapify(tmp_heap)
 
-        while len(tmp_list) > 1:
-            tmp_list.sort(key=lambda x: x.get_freq())
+        while len(tmp_heap) > 1:
             # 取出最小的两个
-            tmp1 = tmp_list[0]
-            tmp2 = tmp_list[1]
-            tmp_list = tmp_list[2:]
+            tmp1 = heapq.heappop(tmp_heap)[2]
+            tmp2 = heapq.heappop(tmp_heap)[2]
 
             new_tree = Haffuman(1, 0, 0, tmp1, tmp2)
-            # 追加在列表末尾
-            tmp_list.append(new_tree)
+            # 放回堆中
+            heapq.heappush(tmp_heap, (new_tree.get_freq(), order, new_tree))
+            order = order + 1
 
-        return tmp_list[0]
+        return tmp_heap[0][2]
 
-    def write_an_int2byte(self, num_int, output):
+    def write_varint(self, num_int, output):
         """
-        给一个 int类型数， 给一个文件流 把int 型数据转化成bytes 写入文件
+        写入变长整数: 从低位开始每7位一个字节 最高位为1表示后面还有字节
+        小于128的数只要1个字节 64位的数最多10个字节
         :param num_int:
         :param output:
         :return:
         """
-        tmp = bin(num_int)[2:]
-        tmp = (32 - len(tmp)) * '0' + tmp
-        for i in range(0, 4):
-            code_tmp = int(tmp[i * 8:i * 8 + 8], 2)
-            output.write(six.int2byte(code_tmp))
+        data = bytearray()
+        while num_int >= 0x80:
+            data.append((num_int & 0x7f) | 0x80)
+            num_int = num_int >> 7
+        data.append(num_int)
+        output.write(data)
+
+    def get_varint(self, start, file_data):
+        """
+        从 start 开始读取一个变长整数
+        :param start:
+        :param file_data:
+        :return: 数, 结束的位置
+        """
+        num_int = 0
+        shift = 0
+        while True:
+            if start >= len(file_data):
+                raise ValueError("压缩文件已损坏")
+            byte = file_data[start]
+            start = start + 1
+            num_int = num_int | ((byte & 0x7f) << shift)
+            if byte < 0x80:
+                return num_int, start
+            shift = shift + 7
+
+    def read_size(self, f):
+        """
+        从文件流 f 读取块里的一个字节数 FORMAT_VARINT 开始是变长整数 之前是4字节
+        :param f:
+        :return:
+        """
+        if self.block_version < FORMAT_VARINT:
+            return self.get_an_int2byte(0, f.read(4))
+        data = bytearray()
+        while True:
+            byte = f.read(1)
+            if not byte:
+                raise ValueError("压缩文件已损坏")
+            data += byte
+            if byte[0] < 0x80:
+                return self.get_varint(0, data)[0]
 
     def get_freq_dict(self, file_data, file_size):
         """
@@ -171,28 +348,92 @@ class Work(object):
         :param file_size:
         :return: char_freq
         """
+        # 按块统计 大文件也不会一次生成巨大的中间数组
+        freq_list = [0] * 256
+        data_view = memoryview(file_data)
+        for i in range(0, file_size, FREQ_CHUNK_SIZE):
+            self.count_bytes(data_view[i:i + FREQ_CHUNK_SIZE], freq_list)
+
+        return self.freq_list2dict(freq_list)
+
+    def sample_freq_list(self, file_size):
+        """
+        采样统计频率: 在文件里等间隔取若干段 每段 SAMPLE_CHUNK_SIZE 个字节 一共约 sample 个字节
+        每个字节至少记1次 没采到的字节也有编码 文件里出现了也能编码
+        :param file_size:
+        :return: 长度为256的频率列表
+        """
+        freq_list = [1] * 256
+        count = max(1, self.sample // SAMPLE_CHUNK_SIZE)
+        f = open(self.input_file, 'rb')
+        for k in range(count):
+            f.seek(k * file_size // count)
+            self.count_bytes(f.read(SAMPLE_CHUNK_SIZE), freq_list)
+        f.close()
+        return freq_list
+
+    def freq_list2dict(self, freq_list):
+        """
+        长度为256的频率列表转化成频率字典 只保留出现过的字节 按字节值从小到大
+        :param freq_list:
+        :return: char_freq
+        """
         char_freq = {}
-        for i in range(file_size):
-            char_value = file_data[i]
-            if char_value in char_freq.keys():
-                char_freq[char_value] = char_freq[char_value] + 1
-            else:
-                char_freq[char_value] = 1
+        for i in range(256):
+            if freq_list[i] > 0:
+                char_freq[i] = freq_list[i]
 
         return char_freq
 
-    def reverse_dict(self, char_freq):
+    def use_stored(self, char_freq, size):
         """
-        翻转字典： 键==》值 变成 值==》键
-        :param char_freq:
-        :return: reverse_char_freq
+        由频率估计哈弗曼编码能不能压缩这段数据 不能的话直接存原数据 省掉编码的时间
+        熵是哈弗曼编码平均长度的下界 熵接近8位时省下的还不够写编码长度表
+        :param char_freq: 频率字典
+        :param size:
+        :return: True 表示直接存原数据
         """
-        reverse_char_freq = {}
-        for key in char_freq.keys():
-            new_key = char_freq[key]
-            reverse_char_freq[new_key] = key
+        entropy = 0.0
+        for freq in char_freq.values():
+            entropy = entropy - freq * math.log2(freq / size)
+        entropy = entropy / size
+        # 编码长度表 1 + 2 * 字符个数 字节 编码字节数4字节
+        head_size = 1 + 2 * len(char_freq) + 4
+        return entropy >= STORED_ENTROPY or size * entropy / 8 + head_size >= size
+
+    def rle_encode(self, data):
+        """
+        游程编码: 4到259个相同的字节写成前4个字节加1个字节的重复次数 (减4) 更长的分成几段
+        没有匹配的部分原样保留 由正则在 C 里扫描 只有长游程才调用 Python
+        :param data:
+        :return: 编码后的 bytes
+        """
+        return RUN_PATTERN.sub(lambda m: m.group(0)[:4] + six.int2byte(len(m.group(0)) - 4), data)
 
-        return reverse_char_freq
+    def rle_decode(self, data):
+        """
+        游程解码: 连续4个相同的字节后面那个字节是再重复的次数
+        编码时没匹配的部分不会有连续4个相同的字节 所以从左往右找到的正好是编码写的游程
+        :param data:
+        :return: 解码后的 bytes
+        """
+        return RUN_DECODE_PATTERN.sub(lambda m: m.group(1) * (4 + m.group(2)[0]), data)
+
+    def count_bytes(self, chunk, freq_list):
+        """
+        统计一块数据中每个字节出现的次数 累加到长度为256的 freq_list 中
+        有 numpy 就用 bincount 没有就用标准库的 Counter (C 实现 比逐字节判断快得多)
+        :param chunk:
+        :param freq_list:
+        :return:
+        """
+        if numpy is not None:
+            counts = numpy.bincount(numpy.frombuffer(chunk, dtype=numpy.uint8), minlength=256).tolist()
+            for i in range(256):
+                freq_list[i] = freq_list[i] + counts[i]
+        else:
+            for key, value in Counter(chunk).items():
+                freq_list[key] = freq_list[key] + value
 
     def get_encode_char_freq(self, char_freq):
         """
@@ -206,63 +447,1069 @@ class Work(object):
         haffuman_tree.encode_haffuman_tree(haffuman_tree.get_root(), '', char_freq)
 
         # 如果文件只有一种字符的话 进行修正 
-        # 其实只有一个字符还可以继续优化 例如直接写入 （字符and size）这样更加节省空间
+        # 分块格式里这样的块直接写入 （字符and size） 见 BLOCK_CONSTANT
         if len(char_freq) == 1:
             for i in char_freq.keys():
                 char_freq[i] = '0'
 
         return char_freq
 
-    def haffuman_compress(self):
+    def get_an_int2byte(self, start, file_data):
+        """
+        从 start 开始读取4个字节 (大端) 转化成 int
+        :param start:
+        :param file_data:
+        :return:
+        """
+        return int.from_bytes(file_data[start:start + 4], 'big')
+
+    def get_file_size(self, version, file_data, start):
+        """
+        读取头部的文件大小 FORMAT_VARINT 和 FORMAT_CANONICAL_VARINT 是变长整数 其他版本是4字节
+        :param version:
+        :param file_data:
+        :param start: 文件大小开始的位置
+        :return: 文件大小, 结束的位置
+        """
+        if version in (FORMAT_VARINT, FORMAT_CANONICAL_VARINT):
+            return self.get_varint(start, file_data)
+        return self.get_an_int2byte(start, file_data), start + 4
+
+    def get_code_lengths(self, char_freq):
+        """
+        由频率字典建哈弗曼树 只取每个字符编码的长度
+        :param char_freq:
+        :return: code_lengths
+        """
+        code_lengths = {}
+        encode_char_freq = self.get_encode_char_freq(dict(char_freq))
+        for key in encode_char_freq.keys():
+            code_lengths[key] = len(encode_char_freq[key])
+
+        # 超过最大编码长度的话 用 package-merge 重新求编码长度
+        if self.max_code_length > 0 and max(code_lengths.values()) > self.max_code_length:
+            code_lengths = self.get_limited_code_lengths(char_freq, self.max_code_length)
+
+        return code_lengths
+
+    def get_limited_code_lengths(self, char_freq, max_code_length):
+        """
+        package-merge 算法: 编码长度不超过 max_code_length 时总编码长度最短的编码长度
+        每一轮把上一轮的列表两两打包 再和叶子一起按权重排序 (权重相同叶子在前)
+        做 max_code_length - 1 轮后取前 2n-2 项 每个字符出现几次编码长度就是几
+        :param char_freq:
+        :param max_code_length:
+        :return: code_lengths
+        """
+        leaves = []
+        for freq, key in sorted((char_freq[key], key) for key in char_freq.keys()):
+            leaves.append((freq, (key,)))
+
+        packages = leaves
+        for i in range(max_code_length - 1):
+            paired = []
+            for k in range(0, len(packages) - 1, 2):
+                paired.append((packages[k][0] + packages[k + 1][0], packages[k][1] + packages[k + 1][1]))
+            packages = sorted(leaves + paired, key=lambda x: x[0])
+
+        code_lengths = {}
+        for key in char_freq.keys():
+            code_lengths[key] = 0
+        for freq, keys in packages[:2 * len(leaves) - 2]:
+            for key in keys:
+                code_lengths[key] = code_lengths[key] + 1
+
+        return code_lengths
+
+    def get_canonical_char_freq(self, code_lengths):
+        """
+        根据编码长度直接得到范式哈弗曼编码 不需要建树
+        按 (长度, 字节值) 排序 编码依次加一 长度变长时左移补零
+        :param code_lengths:
+        :return: 编码后的字典
+        """
+        char_freq = {}
+        code = 0
+        last_length = 0
+        for key in sorted(code_lengths.keys(), key=lambda x: (code_lengths[x], x)):
+            length = code_lengths[key]
+            code = code << (length - last_length)
+            tmp = bin(code)[2:]
+            char_freq[key] = (length - len(tmp)) * '0' + tmp
+            code = code + 1
+            last_length = length
+
+        return char_freq
+
+    def write_code_lengths(self, code_lengths, output):
+        """
+        写入编码长度表: 字符个数减一(1字节) 然后每个字符 (字节值, 编码长度) 各1字节
+        :param code_lengths:
+        :param output:
+        :return:
+        """
+        output.write(six.int2byte(len(code_lengths) - 1))
+        for key in sorted(code_lengths.keys()):
+            output.write(six.int2byte(key))
+            output.write(six.int2byte(code_lengths[key]))
+
+    def read_code_lengths(self, start, file_data):
+        """
+        从 start 开始读取编码长度表
+        :param start:
+        :param file_data:
+        :return: 编码长度字典, 表结束的位置
+        """
+        leaf_nodes = file_data[start] + 1
+        start = start + 1
+        code_lengths = {}
+        for i in range(leaf_nodes):
+            code_lengths[file_data[start + i * 2]] = file_data[start + i * 2 + 1]
+
+        return code_lengths, start + leaf_nodes * 2
+
+    def encode_data(self, chunks, char_freq, output):
+        """
+        编码 chunks 中的每一块数据并写入 output 装了 numpy 就用 numpy 批量编码
+        :param chunks: 数据块的列表或生成器
+        :param char_freq:
+        :param output:
+        :return: 写入的字节数
+        """
+        if numpy is not None:
+            return self.encode_data_numpy(chunks, char_freq, output)
+        return self.encode_data_python(chunks, char_freq, output)
+
+    def encode_data_numpy(self, chunks, char_freq, output):
+        """
+        用 numpy 编码 输出和 encode_data_python 逐字节相同 编码超过64位时用 encode_data_python
+        用前缀和算出每个编码的起始位 把编码移到所在的64位字里 (可能跨两个字)
+        同一个字里的编码按位不重叠 相加就是拼接 最后不满64位的字留给下一段
+        :param chunks: 数据块的列表或生成器
+        :param char_freq:
+        :param output:
+        :return: 写入的字节数
+        """
+        code_table = numpy.zeros(256, dtype=numpy.uint64)
+        length_table = numpy.zeros(256, dtype=numpy.int64)
+        for key in char_freq.keys():
+            if len(char_freq[key]) > 64:
+                return self.encode_data_python(chunks, char_freq, output)
+            # 编码左对齐放在64位里
+            code_table[key] = int(char_freq[key], 2) << (64 - len(char_freq[key]))
+            length_table[key] = len(char_freq[key])
+
+        # last 是上一段最后不满64位的字 bit_count 是其中的位数
+        last = numpy.uint64(0)
+        bit_count = 0
+        written = 0
+        for chunk in chunks:
+            data = numpy.frombuffer(chunk, dtype=numpy.uint8)
+            for i in range(0, len(data), NUMPY_ENCODE_SIZE):
+                part = data[i:i + NUMPY_ENCODE_SIZE]
+                lengths = length_table[part]
+                starts = numpy.cumsum(lengths) - lengths + bit_count
+                index = starts >> 6
+                offset = (starts & 63).astype(numpy.uint64)
+                # 左对齐的编码右移 offset 位是在第 index 个字里的部分
+                # 左移 64 - offset 位是跨到下一个字的部分 (分两次移 offset 为0时结果是0)
+                codes = code_table[part]
+                high = codes >> offset
+                low = (codes << (numpy.uint64(63) - offset)) << numpy.uint64(1)
+
+                total = bit_count + int(lengths.sum())
+                words = numpy.zeros(total // 64 + 2, dtype=numpy.uint64)
+                words[0] = last
+                # index 是递增的 按 index 分组求和
+                first = numpy.flatnonzero(numpy.concatenate(([True], index[1:] != index[:-1])))
+                words[index[first]] += numpy.add.reduceat(high, first)
+                words[index[first] + 1] += numpy.add.reduceat(low, first)
+
+                full = total // 64
+                output.write(words[:full].astype('>u8').tobytes())
+                written = written + full * 8
+                last = words[full]
+                bit_count = total % 64
+
+        # 写入最后不满64位的部分 不满一个字节的补0
+        tail_size = (bit_count + 7) // 8
+        output.write(int(last).to_bytes(8, 'big')[:tail_size])
+
+        return written + tail_size
+
+    def encode_data_python(self, chunks, char_freq, output):
+        """
+        用整数位缓冲编码 chunks 中的每一块数据并写入 output 位缓冲跨块保留
+        编码累加在 bit_buf 中 满64位放进预先分配好的 words 数组 数组满了才写一次文件
+        :param chunks: 数据块的列表或生成器
+        :param char_freq:
+        :param output:
+        :return: 写入的字节数
+        """
+        # 每个字节的 (编码, 编码长度) 用整数表示
+        codes = [(0, 0)] * 256
+        for key in char_freq.keys():
+            codes[key] = (int(char_freq[key], 2), len(char_freq[key]))
+
+        words = array.array('Q', bytes(ENCODE_CHUNK_SIZE))
+        words_size = len(words)
+        k = 0
+        bit_buf = 0
+        bit_count = 0
+        written = 0
+        for chunk in chunks:
+            for x in chunk:
+                code, length = codes[x]
+                bit_buf = (bit_buf << length) | code
+                bit_count = bit_count + length
+                if bit_count >= 64:
+                    bit_count = bit_count - 64
+                    words[k] = bit_buf >> bit_count
+                    bit_buf = bit_buf & ((1 << bit_count) - 1)
+                    k = k + 1
+                    if k == words_size:
+                        written = written + self.write_words(words, k, output)
+                        k = 0
+        written = written + self.write_words(words, k, output)
+
+        # 写入最后不满64位的部分 不满一个字节的补0
+        tail_size = (bit_count + 7) // 8
+        output.write((bit_buf << (tail_size * 8 - bit_count)).to_bytes(tail_size, 'big'))
+
+        return written + tail_size
+
+    def write_words(self, words, k, output):
+        """
+        把 words 前 k 个64位整数按大端写入 output
+        :param words:
+        :param k:
+        :param output:
+        :return: 写入的字节数
+        """
+        if sys.byteorder == 'little':
+            words.byteswap()
+        output.write(memoryview(words)[:k])
+        return k * 8
+
+    def build_decode_table(self, char_freq, table_bits=0):
+        """
+        由编码字典建解码查找表
+        表宽 table_bits 位 用接下来的 table_bits 位做下标 一次查到 (字符, 编码长度)
+        比表宽还长的编码 表里记为 (0, 0) 放到 long_codes 里 按 (长度, 编码) 查
+        :param char_freq:
+        :param table_bits: 表宽 为0时取最长编码的长度 但不超过 DECODE_TABLE_BITS
+        :return: table, table_bits, long_codes
+        """
+        if table_bits == 0:
+            max_length = 0
+            for code in char_freq.values():
+                max_length = max(max_length, len(code))
+            table_bits = min(max_length, DECODE_TABLE_BITS)
+
+        table = [(0, 0)] * (1 << table_bits)
+        long_codes = {}
+        for key in char_freq.keys():
+            code = char_freq[key]
+            length = len(code)
+            if length <= table_bits:
+                # 以这个编码开头的所有下标都指向这个字符
+                first = int(code, 2) << (table_bits - length)
+                count = 1 << (table_bits - length)
+                table[first:first + count] = [(key, length)] * count
+            else:
+                long_codes[(length, int(code, 2))] = key
+
+        return table, table_bits, long_codes
+
+    def build_multi_decode_table(self, table, table_bits):
+        """
+        由一次一个字符的查找表建一次多个字符的查找表
+        每一项是窗口里能完整解出的所有字符 (bytes, 这些编码的总长度)
+        第一个编码就比表宽长的 记为 (b'', 0)
+        :param table:
+        :param table_bits:
+        :return: multi_table
+        """
+        mask = (1 << table_bits) - 1
+        multi_table = []
+        for i in range(1 << table_bits):
+            symbols = bytearray()
+            used = 0
+            index = i
+            while True:
+                char_value, length = table[index]
+                # 移出去的位补的是0 只有编码完全在窗口里才算数
+                if length == 0 or used + length > table_bits:
+                    break
+                symbols.append(char_value)
+                used = used + length
+                index = (index << length) & mask
+            multi_table.append((bytes(symbols), used))
+
+        return multi_table
+
+    def use_multi_decode(self, char_freq):
+        """
+        根据编码长度的分布决定是否一次查表解出多个字符
+        范式编码里长度为 L 的编码大约占 2**-L 的比例 以此估计平均编码长度
+        表宽能放下2个以上的平均编码时才值得
+        :param char_freq:
+        :return: True / False
+        """
+        expected_length = 0.0
+        for code in char_freq.values():
+            expected_length = expected_length + len(code) * 2.0 ** -len(code)
+        return MULTI_TABLE_BITS >= 2 * expected_length
+
+    def read_words(self, f, size):
+        """
+        从文件流 f 的当前位置按块读取 size 个字节 每块转成大端64位整数数组
+        不满8个字节的尾巴留给下一块 读完以后补0 之后一直返回全0的数组
+        :param f:
+        :param size:
+        :return: 64位整数数组的生成器
+        """
+        rest = b''
+        while size > 0:
+            chunk = f.read(min(self.chunk_size, size))
+            if not chunk:
+                break
+            size = size - len(chunk)
+            data = rest + chunk
+            cut = len(data) - len(data) % 8
+            rest = data[cut:]
+            if cut == 0:
+                continue
+            words = array.array('Q', data[:cut])
+            if sys.byteorder == 'little':
+                words.byteswap()
+            yield words
+
+        # 最后不满8个字节的部分补0
+        if rest:
+            words = array.array('Q', rest + bytes(-len(rest) % 8))
+            if sys.byteorder == 'little':
+                words.byteswap()
+            yield words
+        while True:
+            yield array.array('Q', bytes(16))
+
+    def decode_data(self, word_chunks, total_byte, char_freq, output):
+        """
+        查表解码 从 word_chunks 里一块一块取编码 解出 total_byte 个字节写入 output
+        编码位先放进整数位缓冲 bit_buf 里 每次取出表宽的位查表
+        解出的字节放在可以反复使用的输出缓冲里 缓冲满了写一次文件
+        :param word_chunks: 64位整数数组的生成器
+        :param total_byte:
+        :param char_freq:
+        :param output:
+        :return:
+        """
+        if self.use_multi_decode(char_freq):
+            self.decode_data_multi(word_chunks, total_byte, char_freq, output)
+            return
+
+        table, table_bits, long_codes = self.build_decode_table(char_freq)
+        mask = (1 << table_bits) - 1
+        max_length = table_bits
+        for length, code in long_codes.keys():
+            max_length = max(max_length, length)
+
+        out = bytearray(DECODE_CHUNK_SIZE)
+        out_view = memoryview(out)
+        words = next(word_chunks)
+        words_size = len(words)
+        # bit_buf 是位缓冲 shift 是查表窗口之后还剩的位数 小于0就补充64位
+        bit_buf = 0
+        shift = -table_bits
+        pos = 0
+        for done in range(0, total_byte, DECODE_CHUNK_SIZE):
+            n = min(DECODE_CHUNK_SIZE, total_byte - done)
+            for i in range(n):
+                if shift < 0:
+                    if pos == words_size:
+                        # 这一块用完了 取下一块
+                        words = next(word_chunks)
+                        words_size = len(words)
+                        pos = 0
+                    bit_buf = ((bit_buf & 0xffff) << 64) | words[pos]
+                    pos = pos + 1
+                    shift = shift + 64
+                out[i], length = table[(bit_buf >> shift) & mask]
+                if length == 0:
+                    # 编码比表宽长 在窗口后面一位一位往后找
+                    code = (bit_buf >> shift) & mask
+                    length = table_bits
+                    while (length, code) not in long_codes:
+                        if length >= max_length:
+                            raise ValueError("压缩文件已损坏")
+                        if shift == 0:
+                            if pos == words_size:
+                                words = next(word_chunks)
+                                words_size = len(words)
+                                pos = 0
+                            bit_buf = words[pos]
+                            pos = pos + 1
+                            shift = 64
+                        shift = shift - 1
+                        length = length + 1
+                        code = (code << 1) | ((bit_buf >> shift) & 1)
+                    out[i] = long_codes[(length, code)]
+                    # 窗口之后多用掉的位已经从 shift 里减掉了
+                    length = table_bits
+                shift = shift - length
+            output.write(out_view[:n])
+
+    def decode_data_multi(self, word_chunks, total_byte, char_freq, output):
+        """
+        和 decode_data 一样 但每次查表可以解出多个字符
+        最后一次查表可能多解出几个字符 (解的是末尾补的0) 截掉就行
+        :param word_chunks: 64位整数数组的生成器
+        :param total_byte:
+        :param char_freq:
+        :param output:
+        :return:
+        """
+        table, table_bits, long_codes = self.build_decode_table(char_freq, MULTI_TABLE_BITS)
+        multi_table = self.build_multi_decode_table(table, table_bits)
+        mask = (1 << table_bits) - 1
+        max_length = table_bits
+        for length, code in long_codes.keys():
+            max_length = max(max_length, length)
+        # 一次查表最多解出几个字符
+        max_symbols = 1
+        for symbols, length in multi_table:
+            max_symbols = max(max_symbols, len(symbols))
+
+        out = bytearray()
+        words = next(word_chunks)
+        words_size = len(words)
+        # bit_buf 是位缓冲 shift 是查表窗口之后还剩的位数 小于0就补充64位
+        bit_buf = 0
+        shift = -table_bits
+        pos = 0
+        remaining = total_byte
+        while remaining > 0:
+            n = min(DECODE_CHUNK_SIZE, remaining)
+            while len(out) < n:
+                for k in range((n - len(out)) // max_symbols + 1):
+                    if shift < 0:
+                        if pos == words_size:
+                            # 这一块用完了 取下一块
+                            words = next(word_chunks)
+                            words_size = len(words)
+                            pos = 0
+                        bit_buf = ((bit_buf & 0xffff) << 64) | words[pos]
+                        pos = pos + 1
+                        shift = shift + 64
+                    symbols, length = multi_table[(bit_buf >> shift) & mask]
+                    if length == 0:
+                        # 编码比表宽长 在窗口后面一位一位往后找
+                        code = (bit_buf >> shift) & mask
+                        length = table_bits
+                        while (length, code) not in long_codes:
+                            if length >= max_length:
+                                raise ValueError("压缩文件已损坏")
+                            if shift == 0:
+                                if pos == words_size:
+                                    words = next(word_chunks)
+                                    words_size = len(words)
+                                    pos = 0
+                                bit_buf = words[pos]
+                                pos = pos + 1
+                                shift = 64
+                            shift = shift - 1
+                            length = length + 1
+                            code = (code << 1) | ((bit_buf >> shift) & 1)
+                        out.append(long_codes[(length, code)])
+                        # 窗口之后多用掉的位已经从 shift 里减掉了
+                        length = table_bits
+                    else:
+                        out += symbols
+                    shift = shift - length
+            output.write(out[:n])
+            del out[:n]
+            remaining = remaining - n
+
+    def decode_data_interleaved(self, payload, total_byte, char_freq, output):
+        """
+        4路交错解码 payload 开头是前3路的字节数 (变长整数 FORMAT_VARINT 之前各4字节) 后面依次是4路编码
+        第 k 路是这一块原数据的第 k 个四分之一 4个位游标同步前进 每轮各解一个字符
+        4路之间互不依赖 一轮里4次查表不用等前一次的结果 循环次数也只有四分之一
+        编码短到可以一次查表解出多个字符时 用 decode_data_interleaved_multi 4路同步多字符查表
+        编码长度不超过 DECODE_TABLE_BITS 所以单字符查表不用处理长编码
+        :param payload:
+        :param total_byte:
+        :param char_freq:
+        :param output:
+        :return:
+        """
+        # 按跳转表切出4路
+        sizes = []
+        start = 0
+        for k in range(3):
+            if self.block_version >= FORMAT_VARINT:
+                size, start = self.get_varint(start, payload)
+            else:
+                size = self.get_an_int2byte(start, payload)
+                start = start + 4
+            sizes.append(size)
+        sizes.append(len(payload) - start - sum(sizes))
+        parts = []
+        for size in sizes:
+            parts.append(payload[start:start + size])
+            start = start + size
+        quarter = (total_byte + 3) // 4
+
+        # 每一路末尾补0 转成大端64位整数数组
+        lanes = []
+        for part in parts:
+            data = part + bytes(16)
+            words = array.array('Q', data + bytes(-len(data) % 8))
+            if sys.byteorder == 'little':
+                words.byteswap()
+            lanes.append(words)
+
+        if self.use_multi_decode(char_freq):
+            lane_sizes = []
+            for k in range(4):
+                lane_sizes.append(max(0, min(quarter, total_byte - k * quarter)))
+            self.decode_data_interleaved_multi(lanes, lane_sizes, char_freq, output)
+            return
+
+        table, table_bits, long_codes = self.build_decode_table(char_freq)
+        if long_codes:
+            raise ValueError("压缩文件已损坏")
+        mask = (1 << table_bits) - 1
+        words0, words1, words2, words3 = lanes
+
+        # 每路解 quarter 个字符 最后一路不够的部分解的是补的0 最后截掉
+        out0 = bytearray(quarter)
+        out1 = bytearray(quarter)
+        out2 = bytearray(quarter)
+        out3 = bytearray(quarter)
+        buf0 = buf1 = buf2 = buf3 = 0
+        shift0 = shift1 = shift2 = shift3 = -table_bits
+        pos0 = pos1 = pos2 = pos3 = 0
+        for i in range(quarter):
+            if shift0 < 0:
+                buf0 = ((buf0 & 0xffff) << 64) | words0[pos0]
+                pos0 = pos0 + 1
+                shift0 = shift0 + 64
+            if shift1 < 0:
+                buf1 = ((buf1 & 0xffff) << 64) | words1[pos1]
+                pos1 = pos1 + 1
+                shift1 = shift1 + 64
+            if shift2 < 0:
+                buf2 = ((buf2 & 0xffff) << 64) | words2[pos2]
+                pos2 = pos2 + 1
+                shift2 = shift2 + 64
+            if shift3 < 0:
+                buf3 = ((buf3 & 0xffff) << 64) | words3[pos3]
+                pos3 = pos3 + 1
+                shift3 = shift3 + 64
+            out0[i], length0 = table[(buf0 >> shift0) & mask]
+            out1[i], length1 = table[(buf1 >> shift1) & mask]
+            out2[i], length2 = table[(buf2 >> shift2) & mask]
+            out3[i], length3 = table[(buf3 >> shift3) & mask]
+            shift0 -= length0
+            shift1 -= length1
+            shift2 -= length2
+            shift3 -= length3
+
+        output.write(out0)
+        output.write(out1)
+        output.write(out2)
+        output.write(memoryview(out3)[:total_byte - quarter * 3])
+
+    def decode_long_code(self, words, pos, bit_buf, shift, mask, table_bits, max_length, long_codes):
+        """
+        多字符查表遇到比表宽长的编码时 在窗口后面一位一位往后找 (和 decode_data_multi 里的一样)
+        :return: 解出的字符, pos, bit_buf, shift (窗口之后多用掉的位已经从 shift 里减掉了)
+        """
+        code = (bit_buf >> shift) & mask
+        length = table_bits
+        while (length, code) not in long_codes:
+            if length >= max_length:
+                raise ValueError("压缩文件已损坏")
+            if shift == 0:
+                bit_buf = words[pos]
+                pos = pos + 1
+                shift = 64
+            shift = shift - 1
+            length = length + 1
+            code = (code << 1) | ((bit_buf >> shift) & 1)
+        return long_codes[(length, code)], pos, bit_buf, shift
+
+    def decode_data_interleaved_multi(self, lanes, lane_sizes, char_freq, output):
+        """
+        4路同步前进 每路每次查表解出多个字符
+        每次查表解出的字符数不一样 4路不会一起解完 先算出哪一路都不会解过头的轮数
+        (剩下最少的字符数 / 一次最多解出的字符数) 连续解这么多轮 再重新算
+        轮数少于 INTERLEAVE_MIN_ROUNDS 时 剩下的一路一路地解完
+        :param lanes: 4路的大端64位整数数组 末尾补了0
+        :param lane_sizes: 每一路的原字节数
+        :param char_freq:
+        :param output:
+        :return:
+        """
+        table, table_bits, long_codes = self.build_decode_table(char_freq, MULTI_TABLE_BITS)
+        multi_table = self.build_multi_decode_table(table, table_bits)
+        mask = (1 << table_bits) - 1
+        max_length = table_bits
+        for length, code in long_codes.keys():
+            max_length = max(max_length, length)
+        # 一次查表最多解出几个字符
+        max_symbols = 1
+        for symbols, length in multi_table:
+            max_symbols = max(max_symbols, len(symbols))
+
+        words0, words1, words2, words3 = lanes
+        size0, size1, size2, size3 = lane_sizes
+        out0 = bytearray()
+        out1 = bytearray()
+        out2 = bytearray()
+        out3 = bytearray()
+        buf0 = buf1 = buf2 = buf3 = 0
+        shift0 = shift1 = shift2 = shift3 = -table_bits
+        pos0 = pos1 = pos2 = pos3 = 0
+        while True:
+            rounds = min(size0 - len(out0), size1 - len(out1), size2 - len(out2), size3 - len(out3)) // max_symbols
+            if rounds < INTERLEAVE_MIN_ROUNDS:
+                break
+            for i in range(rounds):
+                if shift0 < 0:
+                    buf0 = ((buf0 & 0xffff) << 64) | words0[pos0]
+                    pos0 = pos0 + 1
+                    shift0 = shift0 + 64
+                if shift1 < 0:
+                    buf1 = ((buf1 & 0xffff) << 64) | words1[pos1]
+                    pos1 = pos1 + 1
+                    shift1 = shift1 + 64
+                if shift2 < 0:
+                    buf2 = ((buf2 & 0xffff) << 64) | words2[pos2]
+                    pos2 = pos2 + 1
+                    shift2 = shift2 + 64
+                if shift3 < 0:
+                    buf3 = ((buf3 & 0xffff) << 64) | words3[pos3]
+                    pos3 = pos3 + 1
+                    shift3 = shift3 + 64
+                symbols0, length0 = multi_table[(buf0 >> shift0) & mask]
+                symbols1, length1 = multi_table[(buf1 >> shift1) & mask]
+                symbols2, length2 = multi_table[(buf2 >> shift2) & mask]
+                symbols3, length3 = multi_table[(buf3 >> shift3) & mask]
+                if length0 and length1 and length2 and length3:
+                    out0 += symbols0
+                    out1 += symbols1
+                    out2 += symbols2
+                    out3 += symbols3
+                    shift0 -= length0
+                    shift1 -= length1
+                    shift2 -= length2
+                    shift3 -= length3
+                    continue
+                # 有一路遇到长编码
+                if length0:
+                    out0 += symbols0
+                    shift0 -= length0
+                else:
+                    char_value, pos0, buf0, shift0 = self.decode_long_code(words0, pos0, buf0, shift0, mask,
+                                                                           table_bits, max_length, long_codes)
+                    out0.append(char_value)
+                    shift0 -= table_bits
+                if length1:
+                    out1 += symbols1
+                    shift1 -= length1
+                else:
+                    char_value, pos1, buf1, shift1 = self.decode_long_code(words1, pos1, buf1, shift1, mask,
+                                                                           table_bits, max_length, long_codes)
+                    out1.append(char_value)
+                    shift1 -= table_bits
+                if length2:
+                    out2 += symbols2
+                    shift2 -= length2
+                else:
+                    char_value, pos2, buf2, shift2 = self.decode_long_code(words2, pos2, buf2, shift2, mask,
+                                                                           table_bits, max_length, long_codes)
+                    out2.append(char_value)
+                    shift2 -= table_bits
+                if length3:
+                    out3 += symbols3
+                    shift3 -= length3
+                else:
+                    char_value, pos3, buf3, shift3 = self.decode_long_code(words3, pos3, buf3, shift3, mask,
+                                                                           table_bits, max_length, long_codes)
+                    out3.append(char_value)
+                    shift3 -= table_bits
+
+        # 剩下的一路一路地解完
+        lane_states = ((words0, out0, size0, buf0, shift0, pos0), (words1, out1, size1, buf1, shift1, pos1),
+                       (words2, out2, size2, buf2, shift2, pos2), (words3, out3, size3, buf3, shift3, pos3))
+        for words, out, size, bit_buf, shift, pos in lane_states:
+            while len(out) < size:
+                if shift < 0:
+                    bit_buf = ((bit_buf & 0xffff) << 64) | words[pos]
+                    pos = pos + 1
+                    shift = shift + 64
+                symbols, length = multi_table[(bit_buf >> shift) & mask]
+                if length == 0:
+                    char_value, pos, bit_buf, shift = self.decode_long_code(words, pos, bit_buf, shift, mask,
+                                                                            table_bits, max_length, long_codes)
+                    out.append(char_value)
+                    length = table_bits
+                else:
+                    out += symbols
+                shift = shift - length
+            output.write(memoryview(out)[:size])
+
+    def get_format_version(self, file_data):
+        """
+        判断压缩文件的格式版本
+        旧格式开头就是文件大小 第5个字节是叶子个数的最高字节 一定是0
+        新格式开头是 FILE_MAGIC 后面跟一个不为0的版本号
+        :param file_data:
+        :return: 版本号, 文件大小开始的位置
+        """
+        if len(file_data) > 5 and file_data[0:4] == FILE_MAGIC and file_data[4] != FORMAT_LEGACY:
+            return file_data[4], 5
+        return FORMAT_LEGACY, 0
+
+    def compress_block(self, offset, size):
+        """
+        压缩输入文件从 offset 开始的 size 个字节 返回压缩好的一块:
+        原始字节数 存储方式(1字节) 编码长度表 编码字节数 编码 (4路时编码前面还有前3路的字节数) 字节数都是变长整数
+        压缩不了的块存储方式是 BLOCK_STORED 后面直接是原数据
+        只有一种字符的块是 BLOCK_CONSTANT 后面只有这个字符
+        游程编码变短了的块是 BLOCK_RLE 后面是游程编码后的字节数 再接游程编码结果的编码长度表和编码
+        :param offset:
+        :param size:
+        :return: 压缩后的 bytes
+        """
+        f = open(self.input_file, 'rb')
+        f.seek(offset)
+        data = f.read(size)
+        f.close()
+
+        block = io.BytesIO()
+        self.write_varint(size, block)
+        freq_dict = self.get_freq_dict(data, size)
+        if len(freq_dict) == 1:
+            block.write(six.int2byte(BLOCK_CONSTANT))
+            block.write(data[:1])
+            return block.getvalue()
+
+        mode = BLOCK_HUFFMAN
+        raw_data = data
+        if self.rle:
+            rle_data = self.rle_encode(data)
+            if len(rle_data) < size:
+                # 之后编码的是游程编码的结果
+                mode = BLOCK_RLE
+                data = rle_data
+                freq_dict = self.get_freq_dict(data, len(data))
+        if self.use_stored(freq_dict, len(data)):
+            block.write(six.int2byte(BLOCK_STORED))
+            block.write(raw_data)
+            return block.getvalue()
+
+        block.write(six.int2byte(mode))
+        if mode == BLOCK_RLE:
+            self.write_varint(len(data), block)
+        code_lengths = self.get_code_lengths(freq_dict)
+        self.write_code_lengths(code_lengths, block)
+
+        char_freq = self.get_canonical_char_freq(code_lengths)
+        payload = io.BytesIO()
+        if self.streams == 4:
+            # 4路: 原数据分成4段分别编码 先写前3路的字节数 再依次写4路编码
+            quarter = (len(data) + 3) // 4
+            parts = []
+            for k in range(4):
+                part = io.BytesIO()
+                self.encode_data([data[k * quarter:(k + 1) * quarter]], char_freq, part)
+                parts.append(part.getvalue())
+            for k in range(3):
+                self.write_varint(len(parts[k]), payload)
+            for part in parts:
+                payload.write(part)
+        else:
+            self.encode_data([data], char_freq, payload)
+        self.write_varint(len(payload.getvalue()), block)
+        block.write(payload.getvalue())
+
+        return block.getvalue()
+
+    def block_compress(self):
+        """
+        分块压缩: 文件大小 块大小 (变长整数) 最大编码长度(1字节) 编码路数(1字节) 然后按顺序写入每一块
+        最后写入块索引: 每块 (在压缩文件中的位置, 在原文件中的位置) 各8字节 再写块数(8字节)
+        每块相互独立 多进程同时压缩 按顺序写入
+        :return:
+        """
+        file_size = os.path.getsize(self.input_file)
+        output = open(self.output_file, 'wb')
+
+        # 写入格式标记和版本号
+        # 4路交错解码时每一路都只用一张表查 编码长度不能超过 DECODE_TABLE_BITS
+        if self.streams == 4 and not 0 < self.max_code_length <= DECODE_TABLE_BITS:
+            self.max_code_length = DECODE_TABLE_BITS
+
+        output.write(FILE_MAGIC + six.int2byte(FORMAT_VARINT))
+        self.write_varint(file_size, output)
+        self.write_varint(self.block_size, output)
+        output.write(six.int2byte(self.max_code_length))
+        output.write(six.int2byte(self.streams))
+
+        offsets = range(0, file_size, self.block_size)
+        block_index = []
+        if self.workers <= 1 or len(offsets) <= 1:
+            for offset in offsets:
+                block_index.append((output.tell(), offset))
+                output.write(self.compress_block(offset, min(self.block_size, file_size - offset)))
+        else:
+            # 最多同时有 workers * 2 块在压缩或等待写入 内存占用有上限
+            executor = ProcessPoolExecutor(self.workers)
+            pending = deque()
+            for offset in offsets:
+                size = min(self.block_size, file_size - offset)
+                pending.append((offset, executor.submit(compress_block, self.input_file, offset, size,
+                                                        self.max_code_length, self.streams, self.rle)))
+                if len(pending) >= self.workers * 2:
+                    offset_done, future = pending.popleft()
+                    block_index.append((output.tell(), offset_done))
+                    output.write(future.result())
+            while pending:
+                offset_done, future = pending.popleft()
+                block_index.append((output.tell(), offset_done))
+                output.write(future.result())
+            executor.shutdown()
+
+        # 写入块索引
+        for block_offset, raw_offset in block_index:
+            output.write(struct.pack('>QQ', block_offset, raw_offset))
+        output.write(struct.pack('>Q', len(block_index)))
+
+        output.close()
+        return "压缩完毕"
+
+    def read_block_options(self, version, file_data, start):
+        """
+        读取分块格式头部 块大小之后的选项 (最大编码长度 编码路数) 记下版本号
+        :param version:
+        :param file_data: 压缩文件开头的数据
+        :param start: 文件大小开始的位置
+        :return:
+        """
+        self.block_version = version
+        if version >= FORMAT_VARINT:
+            # 跳过文件大小和块大小
+            start = self.get_varint(start, file_data)[1]
+            start = self.get_varint(start, file_data)[1]
+        else:
+            start = start + 8
+        if version >= FORMAT_LIMITED:
+            self.max_code_length = file_data[start]
+        if version >= FORMAT_STREAMS:
+            self.streams = file_data[start + 1]
+
+    def read_block_index(self, f):
+        """
+        读取文件末尾的块索引
+        :param f:
+        :return: [(在压缩文件中的位置, 在原文件中的位置), ...]
+        """
+        # FORMAT_VARINT 开始每项和块数都是8字节 之前是4字节
+        if self.block_version >= FORMAT_VARINT:
+            entry_format = '>QQ'
+        else:
+            entry_format = '>II'
+        entry_size = struct.calcsize(entry_format)
+        f.seek(-entry_size // 2, 2)
+        count = int.from_bytes(f.read(entry_size // 2), 'big')
+        f.seek(-entry_size // 2 - count * entry_size, 2)
+        index_data = f.read(count * entry_size)
+        block_index = []
+        for block_offset, raw_offset in struct.iter_unpack(entry_format, index_data):
+            block_index.append((block_offset, raw_offset))
+
+        return block_index
+
+    def decode_block(self, f, block_offset, output):
+        """
+        解码压缩文件流 f 中 block_offset 位置的一块 写入 output
+        :param f:
+        :param block_offset:
+        :param output:
+        :return: 这一块的原始字节数
+        """
+        f.seek(block_offset)
+        size = self.read_size(f)
+        mode = BLOCK_HUFFMAN
+        if self.block_version >= FORMAT_STORED:
+            mode = f.read(1)[0]
+        if mode == BLOCK_STORED:
+            output.write(f.read(size))
+            return size
+        if mode == BLOCK_CONSTANT:
+            output.write(f.read(1) * size)
+            return size
+        if mode == BLOCK_RLE:
+            # 先解出游程编码的结果 再游程解码
+            rle_size = self.read_size(f)
+            rle_data = io.BytesIO()
+            self.decode_block_data(f, rle_size, rle_data)
+            data = self.rle_decode(rle_data.getvalue())
+            if len(data) != size:
+                raise ValueError("压缩文件已损坏")
+            output.write(data)
+            return size
+
+        self.decode_block_data(f, size, output)
+        return size
+
+    def decode_block_data(self, f, size, output):
+        """
+        从文件流 f 的当前位置读取编码长度表和编码 解出 size 个字节写入 output
+        :param f:
+        :param size:
+        :param output:
+        :return:
+        """
+        # 编码长度表: 字符个数减一(1字节) 然后每个字符2个字节
+        head = f.read(1)
+        head = head + f.read((head[0] + 1) * 2)
+        code_lengths = self.read_code_lengths(0, head)[0]
+        payload_size = self.read_size(f)
+        if self.max_code_length > 0 and max(code_lengths.values()) > self.max_code_length:
+            raise ValueError("压缩文件已损坏")
+
+        char_freq = self.get_canonical_char_freq(code_lengths)
+        if self.streams == 4:
+            self.decode_data_interleaved(f.read(payload_size), size, char_freq, output)
+        else:
+            self.decode_data(self.read_words(f, payload_size), size, char_freq, output)
 
+    def decompress_block(self, block_offset, raw_offset):
+        """
+        解压压缩文件中 block_offset 位置的一块 写到输出文件的 raw_offset 位置
+        输出文件要已经存在 多个进程各写各的位置 互不影响
+        :param block_offset:
+        :param raw_offset:
+        :return:
+        """
+        f = open(self.input_file, 'rb')
+        output = open(self.output_file, 'r+b')
+        output.seek(raw_offset)
+        self.decode_block(f, block_offset, output)
+        output.close()
+        f.close()
+
+    def read_range(self, offset, length):
+        """
+        随机读取: 只解码覆盖原文件 [offset, offset + length) 的那几块
+        只支持分块格式的压缩文件
+        :param offset:
+        :param length:
+        :return: 读到的 bytes 超出原文件的部分不返回
+        """
+        if offset < 0 or length < 0:
+            raise ValueError("offset 和 length 不能是负数")
         f = open(self.input_file, 'rb')
+        head = f.read(32)
+        version, start = self.get_format_version(head)
+        if version not in BLOCK_FORMATS:
+            f.close()
+            raise ValueError("只有分块格式的压缩文件可以随机读取")
+        total_byte = self.get_file_size(version, head, start)[0]
+        self.read_block_options(version, head, start)
+        end = min(offset + length, total_byte)
+        if offset >= end:
+            f.close()
+            return b''
+
+        # 在块索引里二分查找 offset 所在的块
+        block_index = self.read_block_index(f)
+        raw_offsets = [raw_offset for block_offset, raw_offset in block_index]
+        i = bisect.bisect_right(raw_offsets, offset) - 1
+        first = raw_offsets[i]
+
+        data = io.BytesIO()
+        while i < len(block_index) and raw_offsets[i] < end:
+            self.decode_block(f, block_index[i][0], data)
+            i = i + 1
+        f.close()
 
-        file_data = f.read()
+        return data.getvalue()[offset - first:end - first]
+
+    def block_decompress(self, total_byte):
+        """
+        根据块索引解压每一块 先把输出文件设成原文件大小 每块直接写到自己的位置
+        块数多于一块并且 workers 大于1 时多进程同时解压
+        :param total_byte:
+        :return:
+        """
+        f = open(self.input_file, 'rb')
+        block_index = self.read_block_index(f)
         f.close()
+
+        output = open(self.output_file, 'wb')
+        output.truncate(total_byte)
+        output.close()
+
+        if self.workers <= 1 or len(block_index) <= 1:
+            for block_offset, raw_offset in block_index:
+                self.decompress_block(block_offset, raw_offset)
+        else:
+            executor = ProcessPoolExecutor(self.workers)
+            futures = []
+            for block_offset, raw_offset in block_index:
+                futures.append(executor.submit(decompress_block, self.input_file, self.output_file,
+                                               block_offset, raw_offset, self.max_code_length, self.streams,
+                                               self.block_version))
+            for future in futures:
+                # 子进程出错的话在这里抛出
+                future.result()
+            executor.shutdown()
+
+    def haffuman_compress(self):
+        if self.block_size > 0:
+            return self.block_compress()
+
+        # 不一次读入整个文件 统计频率和编码各按块读一遍
         file_size = os.path.getsize(self.input_file)
         output = open(self.output_file, 'wb')
-        if file_size == 0:
-            # 如果文件没有内容 写入文件长度（0） 退出
-            self.write_an_int2byte(file_size, output)
-            return "压缩完毕"
 
-        # 得到频率字典
-        char_freq = self.get_freq_dict(file_data, file_size)
-        print(char_freq)
+        # 写入格式标记和版本号
+        output.write(FILE_MAGIC + six.int2byte(FORMAT_CANONICAL_VARINT))
 
-        # 开始写入信息
         # 写入文件总字节数：
-        self.write_an_int2byte(file_size, output)
+        self.write_varint(file_size, output)
+        if file_size == 0:
+            # 如果文件没有内容 只有文件长度（0） 退出
+            output.close()
+            return "压缩完毕"
 
-        # 写入字符的叶子节点总个数
-        length = len(char_freq.keys())
-        self.write_an_int2byte(length, output)
+        if 0 < self.sample < file_size:
+            # 只采样统计频率 编码时才把整个文件读一遍
+            freq_list = self.sample_freq_list(file_size)
+        else:
+            # 第一遍: 按块统计得到频率字典
+            freq_list = [0] * 256
+            for chunk in self.read_chunks():
+                self.count_bytes(chunk, freq_list)
+        char_freq = self.freq_list2dict(freq_list)
+        print(char_freq)
 
-        # 开始写入 频率字典 解压缩用于重构hafuman树
-        for i in char_freq.keys():
-            output.write(six.int2byte(i))
-            self.write_an_int2byte(char_freq[i], output)
+        # 只写入每个字符的编码长度 解压时直接由长度得到范式编码
+        code_lengths = self.get_code_lengths(char_freq)
+        self.write_code_lengths(code_lengths, output)
 
         # 得到编码的字符频率字典
-        char_freq = self.get_encode_char_freq(char_freq)
+        char_freq = self.get_canonical_char_freq(code_lengths)
         # print(char_freq)
 
-        # 开始写入文件数据
-        code = ''
-        for x in range(file_size):
-            key = file_data[x]
-            # 开始编码
-            code = code + char_freq[key]
-            # 如果长度大于8位 一个字节一个字节处理
-            while len(code) > 8:
-                out = int(code[0:8], 2)
-                code = code[8:]
-                output.write(six.int2byte(out))
-
-        # 写入最后的八位
-        code = code + (8 - len(code)) * '0'
-        out = int(code, 2)
-        output.write(six.int2byte(out))
+        # 按块编码写入文件数据
+        self.encode_data(self.read_chunks(), char_freq, output)
 
         # 关闭文件
         output.close()
@@ -271,83 +1518,89 @@ class Work(object):
     def haffuman_decompress(self):
         f = open(self.input_file, 'rb')
         output = open(self.output_file, 'wb')
-        file_data = f.read()
-        file_size = os.path.getsize(self.input_file)
-        f.close()
+        # 只读入头部 旧格式的头部最长 8 + 256 * 5 个字节 编码部分之后按块读取
+        file_data = f.read(8 + 256 * 5)
+
+        version, start = self.get_format_version(file_data)
 
         # 得到文件的字节数
-        total_byte_code = ''
-        for i in range(0, 4):
-            tmp = bin(file_data[i])[2:]
-            total_byte_code = total_byte_code + (8 - len(tmp)) * '0' + tmp
-        total_byte = int(total_byte_code, 2)
+        size_start = start
+        total_byte, start = self.get_file_size(version, file_data, start)
 
         if total_byte == 0:
             # 如果压缩的是空文件
+            f.close()
             output.close()
             return "解压完毕"
 
-        # 得到原始频率字典键的总数
-        the_code = ''
-        for i in range(4, 8):
-            tmp = bin(file_data[i])[2:]
-            the_code = the_code + (8 - len(tmp)) * '0' + tmp
-        leaf_nodes = int(the_code, 2)
-
-        # 得到 字符频率字典
-        char_freq = {}
-        for i in range(leaf_nodes):
-            key = file_data[8 + i * 5 + 0]
-            freq_code = ''
-            for j in range(1, 5):
-                tmp = bin(file_data[8 + i * 5 + j])[2:]
-                freq_code = freq_code + (8 - len(tmp)) * '0' + tmp
-            the_value = int(freq_code, 2)
-            char_freq[key] = the_value
-
-        # 得到编码字符频率字典
-        char_freq = self.get_encode_char_freq(char_freq)
-
-        # 得到翻转后编码频率数组
-        reverse_char_freq = self.reverse_dict(char_freq)
-
-        # 开始根据编码解压缩
-        # 把开头字符总数 频率字典的长度去除
-        code = ''
-        tmp_code = ''
-        tmp_byte = 0  # 存放已经翻译好的字节数
-        reverse_char_freq_keys = reverse_char_freq.keys()
-        for x in range(leaf_nodes * 5 + 8, file_size):
-
-            # 一个字节一个字节读取信息
-            one_char = file_data[x]
-            str_code = bin(one_char)[2:]
-            str_code = (8 - len(str_code)) * '0' + str_code
-            code = code + str_code
+        if version in BLOCK_FORMATS:
+            # 分块格式: 根据块索引解码每一块
+            self.read_block_options(version, file_data, size_start)
+            f.close()
+            output.close()
+            self.block_decompress(total_byte)
+            return "解压完毕！"
+
+        if version == FORMAT_LEGACY:
+            # 旧格式: 得到原始频率字典键的总数
+            leaf_nodes = self.get_an_int2byte(start, file_data)
+            start = start + 4
+
+            # 得到 字符频率字典
+            char_freq = {}
+            for i in range(leaf_nodes):
+                key = file_data[start + i * 5 + 0]
+                char_freq[key] = self.get_an_int2byte(start + i * 5 + 1, file_data)
+            start = start + leaf_nodes * 5
+
+            # 得到编码字符频率字典
+            char_freq = self.get_encode_char_freq(char_freq)
+        else:
+            # 范式哈弗曼: 由编码长度直接得到编码字典
+            code_lengths, start = self.read_code_lengths(start, file_data)
+            char_freq = self.get_canonical_char_freq(code_lengths)
 
-            while True:
-                # 读到文件字节数和原文件字节数相等 解压完毕了
-                if tmp_byte == total_byte:
-                    break
-                # 一个字符一个字符读取
-                tmp_code = tmp_code + code[0]
-                code = code[1:]
-
-                # 得到临时字符串如果在翻转后的编码频率的键值中 那么把键对应的值写入
-                if tmp_code in reverse_char_freq_keys:
-                    tmp_byte = tmp_byte + 1
-                    char_value = reverse_char_freq[tmp_code]
-                    output.write(six.int2byte(char_value))
-                    tmp_code = ''
-
-                if len(code) == 0:
-                    # code 长度为0 说明读取完毕了 跳出继续读取 补充code
-                    break
+        # 从编码开始的位置按块读取 查表解码
+        f.seek(start)
+        self.decode_data(self.read_words(f, os.path.getsize(self.input_file) - start), total_byte, char_freq, output)
         # 关闭文件
+        f.close()
         output.close()
         return "解压完毕！"
 
 
+def compress_block(input_file, offset, size, max_code_length, streams, rle):
+    """
+    在子进程中压缩输入文件的一块
+    :param input_file:
+    :param offset:
+    :param size:
+    :param max_code_length:
+    :param streams:
+    :param rle:
+    :return: 压缩后的 bytes
+    """
+    work = Work(input_file, '', max_code_length=max_code_length, streams=streams, rle=rle)
+    return work.compress_block(offset, size)
+
+
+def decompress_block(input_file, output_file, block_offset, raw_offset, max_code_length, streams, block_version):
+    """
+    在子进程中解压一块 直接写到输出文件对应的位置
+    :param input_file:
+    :param output_file:
+    :param block_offset:
+    :param raw_offset:
+    :param max_code_length:
+    :param streams:
+    :param block_version:
+    :return:
+    """
+    work = Work(input_file, output_file, max_code_length=max_code_length, streams=streams)
+    work.block_version = block_version
+    work.decompress_block(block_offset, raw_offset)
+
+
 class HaffumanForm(QWidget, Ui_Form):
     # TODO: 加个进度条？？？
     def __init__(self):
@@ -470,8 +1723,61 @@ class HaffumanForm(QWidget, Ui_Form):
         self.lineEdit.clear()
 
 
+def main(argv):
+    """
+    命令行入口 不带参数时打开界面
+    :param argv:
+    :return:
+    """
+    parser = argparse.ArgumentParser(description="哈弗曼压缩单个文件 不带参数时打开界面")
+    subparsers = parser.add_subparsers(dest='command')
+
+    parser_compress = subparsers.add_parser('compress', help="压缩文件")
+    parser_compress.add_argument('input')
+    parser_compress.add_argument('output', nargs='?', help="默认为 输入文件名.filebak")
+    parser_compress.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="每块的字节数 为0时不分块")
+    parser_compress.add_argument('--workers', type=int, default=WORKERS, help="进程数")
+    parser_compress.add_argument('--max-code-length', type=int, default=MAX_CODE_LENGTH,
+                                 help="最大编码长度 0表示不限制")
+    parser_compress.add_argument('--streams', type=int, default=STREAMS, choices=(1, 4),
+                                 help="每块的编码路数 4路时解码更快")
+    parser_compress.add_argument('--rle', action='store_true', default=RLE,
+                                 help="哈弗曼编码之前先做游程编码 适合有大段重复字节的文件")
+    parser_compress.add_argument('--sample', type=int, default=SAMPLE_SIZE,
+                                 help="只采样这么多字节统计频率 文件只读一遍 0表示统计整个文件 要和 --block-size 0 一起用")
+
+    parser_decompress = subparsers.add_parser('decompress', help="解压文件")
+    parser_decompress.add_argument('input')
+    parser_decompress.add_argument('output', nargs='?', help="默认为 去掉 .filebak 的文件名")
+    parser_decompress.add_argument('--workers', type=int, default=WORKERS, help="进程数")
+
+    parser_read = subparsers.add_parser('read', help="读取原文件 offset 开始的 length 个字节 输出到标准输出")
+    parser_read.add_argument('input')
+    parser_read.add_argument('offset', type=int)
+    parser_read.add_argument('length', type=int)
+
+    args = parser.parse_args(argv)
+    if args.command == 'compress':
+        if args.sample > 0 and args.block_size > 0:
+            parser.error("--sample 只能和 --block-size 0 一起用")
+        output_filename = args.output or args.input + '.filebak'
+        print(Work(args.input, output_filename, block_size=args.block_size, workers=args.workers,
+                   max_code_length=args.max_code_length, streams=args.streams,
+                   rle=args.rle, sample=args.sample).haffuman_compress())
+    elif args.command == 'decompress':
+        output_filename = args.output or os.path.splitext(args.input)[0]
+        print(Work(args.input, output_filename, workers=args.workers).haffuman_decompress())
+    elif args.command == 'read':
+        if args.offset < 0 or args.length < 0:
+            parser.error("offset 和 length 不能是负数")
+        sys.stdout.buffer.write(Work(args.input, '').read_range(args.offset, args.length))
+    else:
+        app = QApplication(sys.argv)
+        My_win = HaffumanForm()
+        My_win.show()
+        return app.exec_()
+    return 0
+
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    My_win = HaffumanForm()
-    My_win.show()
-    sys.exit(app.exec_())
+    sys.exit(main(sys.argv[1:]))
@@ -1,22 +1,148 @@
+import argparse
+import array
+import fnmatch
+import heapq
+import io
+import math
+import mmap
 import os
 import shutil
+import struct
 import sys
+import tempfile
 import six
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from HuffmanUIfolder import Ui_Form
 import time
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    # 没装 numpy 就用标准库统计频率 用纯 Python 编码
+    numpy = None
+
+# 统计频率时每次处理的字节数
+FREQ_CHUNK_SIZE = 1 << 22
+
+# 解码查找表的最大位数 (表有 2**DECODE_TABLE_BITS 项)
+DECODE_TABLE_BITS = 16
+
+# 压缩和解压时默认的进程数
+WORKERS = os.cpu_count() or 1
+
+# 多进程压缩或解压时每个任务的文件加起来至少这么多字节 小文件很多时不用每个文件发一次任务
+BATCH_SIZE = 1 << 18
+# 每批最多的文件和文件夹个数 空文件很多时一批也不会太大
+BATCH_COUNT = 1024
+# 多进程压缩时正在压缩或等待写入的原文件最多加起来这么多字节 (只有一批时不限制)
+MAX_PENDING_SIZE = 1 << 26
+# 多进程压缩时不小于这么多字节的文件 子进程压缩到临时文件里 只把文件名传回来
+SPOOL_SIZE = 1 << 22
+
+# 一次压缩或解压中最多缓存多少个建好的编码表
+TABLE_CACHE_SIZE = 32
+
+# 编码时输出缓冲的字节数 (8的倍数) 缓冲满了才写一次文件
+ENCODE_CHUNK_SIZE = 1 << 16
+
+# 用 numpy 编码时每次处理的字节数 限制临时数组的大小
+NUMPY_ENCODE_SIZE = 1 << 20
+
+# 每字节的熵 (位) 不低于这个值时哈弗曼编码最多省1%左右 直接存原文件
+STORED_ENTROPY = 7.9
+
+# 压缩文件开头的标记 后面跟1个字节的版本号 旧格式没有标记 (版本号记为0)
+FOLDER_MAGIC = b'\xffHFD'
+FORMAT_LEGACY = 0
+# 范式哈弗曼 每个文件头部只存每个字符的编码长度
+FORMAT_CANONICAL = 1
+# 每个文件的字节数后面多1个字节的存储方式 压缩不了的文件 (jpg zip 等) 直接存原文件
+FORMAT_STORED = 2
+# 存储方式多了只有一种字符的文件 只存这个字符
+FORMAT_CONSTANT = 3
+# 版本号后面多4个字节的字典编号 (0表示没用字典) 文件可以用字典的编码 不写编码长度表
+FORMAT_DICT = 4
+# 长度 个数 文件字节数都写成变长整数 (64位) 能压缩超过4GB的文件
+FORMAT_VARINT = 5
+# 压缩文件末尾多一个目录 记录每个文件的位置 压缩后和原来的字节数 和路径 可以只解压其中几个文件
+FORMAT_INDEX = 6
+# 头部只有根路径 后面每个文件夹和文件一条记录 边遍历文件夹边写入 目录里不写文件个数
+# 目录里也有文件夹 文件夹的压缩后字节数是0 (文件至少有1个字节) 只解压一个文件夹时也能建出里面的空文件夹
+FORMAT_STREAM = 7
+
+# 记录的类型: 文件夹 / 文件 / 结束
+ENTRY_FOLDER = 0
+ENTRY_FILE = 1
+ENTRY_END = 2
+
+# 文件的存储方式: 哈弗曼编码 / 原文件 / 只有一种字符 / 用字典的编码
+FILE_HUFFMAN = 0
+FILE_STORED = 1
+FILE_CONSTANT = 2
+FILE_DICT = 3
+
+# 目录后面是目录开始的位置 (8字节) 和这个标记 共12字节 在压缩文件的最后
+INDEX_MAGIC = b'\xffHIX'
+
+# 字典文件开头的标记 后面是字典编号(4字节) 和编码长度表
+DICT_MAGIC = b'\xffHDC'
+
+
+class Dictionary(object):
+    """
+    训练好的编码表 压缩包里只记录它的编号
+    """
 
+    def __init__(self, dict_id, code_lengths):
+        self.dict_id = dict_id
+        self.code_lengths = code_lengths
+        # 范式编码只算一次 所有文件共用
+        self.char_freq = Work('', '', '').get_canonical_char_freq(code_lengths)
+        self.decode_table = None
 
-class Folder(object):
+    def get_decode_table(self):
+        """
+        解码查找表 第一次用到时才建 之后所有文件共用
+        """
+        if self.decode_table is None:
+            self.decode_table = Work('', '', '').build_decode_table(self.char_freq)
+        return self.decode_table
+
+
+class TableCache(object):
     """
-    文件夹类
+    最近最少使用 (LRU) 的编码表缓存 一次压缩或解压的所有文件共用
+    键是序列化后的频率或编码长度表 一样的文件不用再建树和查找表
     """
 
-    def __init__(self, folder_path):
-        self.folder_path = folder_path
-        self.file_list = []
-        self.folder_list = []
+    def __init__(self, max_size=TABLE_CACHE_SIZE):
+        self.max_size = max_size
+        self.tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """
+        取 key 对应的表 没有就调用 build() 建好放进缓存 超过 max_size 个时丢掉最久没用的
+        """
+        if key in self.tables:
+            self.hits = self.hits + 1
+            self.tables.move_to_end(key)
+            return self.tables[key]
+
+        self.misses = self.misses + 1
+        value = build()
+        self.tables[key] = value
+        if len(self.tables) > self.max_size:
+            self.tables.popitem(last=False)
+        return value
+
+    def get_message(self):
+        return "编码表缓存 命中 %d 次 未命中 %d 次" % (self.hits, self.misses)
 
 
 class LeafNode(object):
@@ -106,68 +232,120 @@ class Haffuman(object):
 
 class Work(object):
 
-    def __init__(self, input_file, output_file, input_file_stream, output_file_stream=None):
+    def __init__(self, input_file, output_file, input_file_stream, output_file_stream=None, dictionary=None,
+                 table_cache=None):
         self.input_file = input_file
         self.output_file = output_file
         self.output_file_stream = output_file_stream
         self.input_file_stream = input_file_stream
+        # 训练好的字典 Dictionary 对象 没有时为 None
+        self.dictionary = dictionary
+        # 所有文件共用的 TableCache 没有时每个文件都重新建表
+        self.table_cache = table_cache
+
+    def get_cached(self, key, build):
+        """
+        有缓存时从缓存里取 key 对应的表 没有缓存时直接调用 build()
+        """
+        if self.table_cache is None:
+            return build()
+        return self.table_cache.get(key, build)
 
     def build_haffuman_tree(self, haffuman_dict):
         """
         给一个字典（键值对） 转化为哈弗曼树
         """
-        tmp_list = []
+        # 用小顶堆代替每次合并都重新排序 (权重, 序号, 树)
+        # 序号保证权重相同时的顺序确定: 叶子按字典顺序在前 新合并的树按生成顺序在后
+        # 这和原来稳定排序+追加到末尾的结果完全一样 所以压缩和解压两边得到的树一模一样
+        tmp_heap = []
+        order = 0
         for x in haffuman_dict.keys():
             tmp = Haffuman(0, x, haffuman_dict[x])
-            tmp_list.append(tmp)
+            tmp_heap.append((tmp.get_freq(), order, tmp))
+            order = order + 1
+        heapq.heapify(tmp_heap)
 
-        while len(tmp_list) > 1:
-            tmp_list.sort(key=lambda x: x.get_freq())
+        while len(tmp_heap) > 1:
             # 取出最小的两个
-            tmp1 = tmp_list[0]
-            tmp2 = tmp_list[1]
-            tmp_list = tmp_list[2:]
+            tmp1 = heapq.heappop(tmp_heap)[2]
+            tmp2 = heapq.heappop(tmp_heap)[2]
 
             new_tree = Haffuman(1, 0, 0, tmp1, tmp2)
-            # 追加在列表末尾
-            tmp_list.append(new_tree)
-
-        return tmp_list[0]
+            # 放回堆中
+            heapq.heappush(tmp_heap, (new_tree.get_freq(), order, new_tree))
+            order = order + 1
 
-    def write_an_int2byte(self, num_int, output):
-        """
-        给一个 int类型数， 给一个文件流 一个字节一个字节的写入
-        """
-        tmp = bin(num_int)[2:]
-        tmp = (32 - len(tmp)) * '0' + tmp
-        for i in range(0, 4):
-            code_tmp = int(tmp[i * 8:i * 8 + 8], 2)
-            output.write(six.int2byte(code_tmp))
+        return tmp_heap[0][2]
 
     def get_freq_dict(self, file_data, file_size):
         """
         给文件数据 文件大小 返回频率字典
         """
+        # 按块统计 大文件也不会一次生成巨大的中间数组
+        freq_list = [0] * 256
+        data_view = memoryview(file_data)
+        for i in range(0, file_size, FREQ_CHUNK_SIZE):
+            self.count_bytes(data_view[i:i + FREQ_CHUNK_SIZE], freq_list)
+
+        # 只保留出现过的字节 按字节值从小到大
         char_freq = {}
-        for i in range(file_size):
-            char_value = file_data[i]
-            if char_value in char_freq.keys():
-                char_freq[char_value] = char_freq[char_value] + 1
-            else:
-                char_freq[char_value] = 1
+        for i in range(256):
+            if freq_list[i] > 0:
+                char_freq[i] = freq_list[i]
 
         return char_freq
 
-    def reverse_dict(self, char_freq):
+    def get_entropy(self, char_freq, file_size):
         """
-        翻转字典： 键==》值 变成 值==》键
+        由频率算出每字节的熵 (位) 是哈弗曼编码平均长度的下界
         """
-        reverse_char_freq = {}
+        entropy = 0.0
+        for freq in char_freq.values():
+            entropy = entropy - freq * math.log2(freq / file_size)
+        return entropy / file_size
+
+    def get_min_size(self, char_freq, file_size):
+        """
+        用文件自己的编码表至少要写多少字节: 编码长度表 1 + 2 * 字符个数 字节 编码字节数4字节 加上编码
+        """
+        return 1 + 2 * len(char_freq) + 4 + file_size * self.get_entropy(char_freq, file_size) / 8
+
+    def use_stored(self, char_freq, file_size):
+        """
+        由频率估计哈弗曼编码能不能压缩这个文件 不能的话直接存原文件
+        熵接近8位时省下的还不够写编码长度表
+        """
+        return (self.get_entropy(char_freq, file_size) >= STORED_ENTROPY or
+                self.get_min_size(char_freq, file_size) >= file_size)
+
+    def use_dictionary(self, char_freq, file_size):
+        """
+        用字典的编码比原文件小 也比用文件自己的编码表最少要写的字节数小 就用字典 不用建树
+        返回字典编码的字节数 不用字典时返回 -1
+        """
+        if self.dictionary is None:
+            return -1
+        total_bits = 0
         for key in char_freq.keys():
-            new_key = char_freq[key]
-            reverse_char_freq[new_key] = key
+            total_bits = total_bits + char_freq[key] * self.dictionary.code_lengths[key]
+        length_ = (total_bits + 7) // 8
+        if length_ + 4 < min(file_size, self.get_min_size(char_freq, file_size)):
+            return length_
+        return -1
 
-        return reverse_char_freq
+    def count_bytes(self, chunk, freq_list):
+        """
+        统计一块数据中每个字节出现的次数 累加到长度为256的 freq_list 中
+        有 numpy 就用 bincount 没有就用标准库的 Counter (C 实现 比逐字节判断快得多)
+        """
+        if numpy is not None:
+            counts = numpy.bincount(numpy.frombuffer(chunk, dtype=numpy.uint8), minlength=256).tolist()
+            for i in range(256):
+                freq_list[i] = freq_list[i] + counts[i]
+        else:
+            for key, value in Counter(chunk).items():
+                freq_list[key] = freq_list[key] + value
 
     def get_encode_char_freq(self, char_freq):
         """
@@ -185,6 +363,240 @@ class Work(object):
 
         return char_freq
 
+    def get_code_lengths(self, char_freq):
+        """
+        由频率字典建哈弗曼树 只取每个字符编码的长度
+        """
+        code_lengths = {}
+        encode_char_freq = self.get_encode_char_freq(dict(char_freq))
+        for key in encode_char_freq.keys():
+            code_lengths[key] = len(encode_char_freq[key])
+
+        return code_lengths
+
+    def get_canonical_char_freq(self, code_lengths):
+        """
+        根据编码长度直接得到范式哈弗曼编码 不需要建树
+        按 (长度, 字节值) 排序 编码依次加一 长度变长时左移补零
+        """
+        char_freq = {}
+        code = 0
+        last_length = 0
+        for key in sorted(code_lengths.keys(), key=lambda x: (code_lengths[x], x)):
+            length = code_lengths[key]
+            code = code << (length - last_length)
+            tmp = bin(code)[2:]
+            char_freq[key] = (length - len(tmp)) * '0' + tmp
+            code = code + 1
+            last_length = length
+
+        return char_freq
+
+    def write_code_lengths(self, code_lengths, output):
+        """
+        写入编码长度表: 字符个数减一(1字节) 然后每个字符 (字节值, 编码长度) 各1字节
+        """
+        output.write(six.int2byte(len(code_lengths) - 1))
+        for key in sorted(code_lengths.keys()):
+            output.write(six.int2byte(key))
+            output.write(six.int2byte(code_lengths[key]))
+
+    def read_code_lengths(self, start, file_data):
+        """
+        从 start 开始读取编码长度表 返回编码长度字典和表结束的位置
+        """
+        leaf_nodes = file_data[start] + 1
+        start = start + 1
+        code_lengths = {}
+        for i in range(leaf_nodes):
+            code_lengths[file_data[start + i * 2]] = file_data[start + i * 2 + 1]
+
+        return code_lengths, start + leaf_nodes * 2
+
+    def encode_data(self, file_data, char_freq, output):
+        """
+        编码 file_data 并写入 output 返回写入的字节数 装了 numpy 就用 numpy 批量编码
+        """
+        if numpy is not None:
+            return self.encode_data_numpy(file_data, char_freq, output)
+        return self.encode_data_python(file_data, char_freq, output)
+
+    def encode_data_numpy(self, file_data, char_freq, output):
+        """
+        用 numpy 编码 输出和 encode_data_python 逐字节相同 编码超过64位时用 encode_data_python
+        用前缀和算出每个编码的起始位 把编码移到所在的64位字里 (可能跨两个字)
+        同一个字里的编码按位不重叠 相加就是拼接
+        """
+        code_table = numpy.zeros(256, dtype=numpy.uint64)
+        length_table = numpy.zeros(256, dtype=numpy.int64)
+        for key in char_freq.keys():
+            if len(char_freq[key]) > 64:
+                return self.encode_data_python(file_data, char_freq, output)
+            # 编码左对齐放在64位里
+            code_table[key] = int(char_freq[key], 2) << (64 - len(char_freq[key]))
+            length_table[key] = len(char_freq[key])
+
+        # last 是上一段最后不满64位的字 bit_count 是其中的位数
+        last = numpy.uint64(0)
+        bit_count = 0
+        written = 0
+        data = numpy.frombuffer(file_data, dtype=numpy.uint8)
+        for i in range(0, len(data), NUMPY_ENCODE_SIZE):
+            part = data[i:i + NUMPY_ENCODE_SIZE]
+            lengths = length_table[part]
+            starts = numpy.cumsum(lengths) - lengths + bit_count
+            index = starts >> 6
+            offset = (starts & 63).astype(numpy.uint64)
+            # 左对齐的编码右移 offset 位是在第 index 个字里的部分
+            # 左移 64 - offset 位是跨到下一个字的部分 (分两次移 offset 为0时结果是0)
+            codes = code_table[part]
+            high = codes >> offset
+            low = (codes << (numpy.uint64(63) - offset)) << numpy.uint64(1)
+
+            total = bit_count + int(lengths.sum())
+            words = numpy.zeros(total // 64 + 2, dtype=numpy.uint64)
+            words[0] = last
+            # index 是递增的 按 index 分组求和
+            first = numpy.flatnonzero(numpy.concatenate(([True], index[1:] != index[:-1])))
+            words[index[first]] += numpy.add.reduceat(high, first)
+            words[index[first] + 1] += numpy.add.reduceat(low, first)
+
+            full = total // 64
+            output.write(words[:full].astype('>u8').tobytes())
+            written = written + full * 8
+            last = words[full]
+            bit_count = total % 64
+
+        # 写入最后不满64位的部分 不满一个字节的补0
+        tail_size = (bit_count + 7) // 8
+        output.write(int(last).to_bytes(8, 'big')[:tail_size])
+
+        return written + tail_size
+
+    def encode_data_python(self, file_data, char_freq, output):
+        """
+        用整数位缓冲编码 file_data 并写入 output 返回写入的字节数
+        编码累加在 bit_buf 中 满64位放进预先分配好的 words 数组 数组满了才写一次文件
+        """
+        # 每个字节的 (编码, 编码长度) 用整数表示
+        codes = [(0, 0)] * 256
+        for key in char_freq.keys():
+            codes[key] = (int(char_freq[key], 2), len(char_freq[key]))
+
+        words = array.array('Q', bytes(ENCODE_CHUNK_SIZE))
+        words_size = len(words)
+        k = 0
+        bit_buf = 0
+        bit_count = 0
+        written = 0
+        for x in file_data:
+            code, length = codes[x]
+            bit_buf = (bit_buf << length) | code
+            bit_count = bit_count + length
+            if bit_count >= 64:
+                bit_count = bit_count - 64
+                words[k] = bit_buf >> bit_count
+                bit_buf = bit_buf & ((1 << bit_count) - 1)
+                k = k + 1
+                if k == words_size:
+                    written = written + self.write_words(words, k, output)
+                    k = 0
+        written = written + self.write_words(words, k, output)
+
+        # 写入最后不满64位的部分 不满一个字节的补0
+        tail_size = (bit_count + 7) // 8
+        output.write((bit_buf << (tail_size * 8 - bit_count)).to_bytes(tail_size, 'big'))
+
+        return written + tail_size
+
+    def write_words(self, words, k, output):
+        """
+        把 words 前 k 个64位整数按大端写入 output 返回写入的字节数
+        """
+        if sys.byteorder == 'little':
+            words.byteswap()
+        output.write(memoryview(words)[:k])
+        return k * 8
+
+    def build_decode_table(self, char_freq):
+        """
+        由编码字典建解码查找表
+        表宽 table_bits 位 用接下来的 table_bits 位做下标 一次查到 (字符, 编码长度)
+        比表宽还长的编码 表里记为 (0, 0) 放到 long_codes 里 按 (长度, 编码) 查
+        """
+        max_length = 0
+        for code in char_freq.values():
+            max_length = max(max_length, len(code))
+        table_bits = min(max_length, DECODE_TABLE_BITS)
+
+        table = [(0, 0)] * (1 << table_bits)
+        long_codes = {}
+        for key in char_freq.keys():
+            code = char_freq[key]
+            length = len(code)
+            if length <= table_bits:
+                # 以这个编码开头的所有下标都指向这个字符
+                first = int(code, 2) << (table_bits - length)
+                count = 1 << (table_bits - length)
+                table[first:first + count] = [(key, length)] * count
+            else:
+                long_codes[(length, int(code, 2))] = key
+
+        return table, table_bits, long_codes
+
+    def decode_data(self, file_data, start, end, total_byte, char_freq, decode_table=None):
+        """
+        查表解码 file_data[start:end] 得到 total_byte 个字节
+        编码位先放进整数位缓冲 bit_buf 里 每次取出表宽的位查表
+        decode_table 是已经建好的查找表 (字典或缓存里的表) 没有时由 char_freq 建
+        """
+        if decode_table is None:
+            decode_table = self.build_decode_table(char_freq)
+        table, table_bits, long_codes = decode_table
+        mask = (1 << table_bits) - 1
+        max_length = table_bits
+        for length, code in long_codes.keys():
+            max_length = max(max_length, length)
+
+        # 按大端64位整数一次读8个字节 末尾补0 补到8的倍数
+        data = bytes(file_data[start:end]) + bytes(16)
+        data = data + bytes(-len(data) % 8)
+        words = array.array('Q', data)
+        if sys.byteorder == 'little':
+            words.byteswap()
+
+        out = bytearray(total_byte)
+        # bit_buf 是位缓冲 shift 是查表窗口之后还剩的位数 小于0就补充64位
+        bit_buf = 0
+        shift = -table_bits
+        pos = 0
+        for i in range(total_byte):
+            if shift < 0:
+                bit_buf = ((bit_buf & 0xffff) << 64) | words[pos]
+                pos = pos + 1
+                shift = shift + 64
+            out[i], length = table[(bit_buf >> shift) & mask]
+            if length == 0:
+                # 编码比表宽长 在窗口后面一位一位往后找
+                code = (bit_buf >> shift) & mask
+                length = table_bits
+                while (length, code) not in long_codes:
+                    if length >= max_length:
+                        raise ValueError("压缩文件已损坏")
+                    if shift == 0:
+                        bit_buf = words[pos]
+                        pos = pos + 1
+                        shift = 64
+                    shift = shift - 1
+                    length = length + 1
+                    code = (code << 1) | ((bit_buf >> shift) & 1)
+                out[i] = long_codes[(length, code)]
+                # 窗口之后多用掉的位已经从 shift 里减掉了
+                length = table_bits
+            shift = shift - length
+
+        return out
+
     @property
     def haffuman_compress(self):
 
@@ -198,7 +610,7 @@ class Work(object):
 
         if file_size == 0:
             # 如果文件没有内容 写入文件长度（0） 退出
-            self.write_an_int2byte(file_size, output)
+            write_varint(file_size, output)
             return "压缩完毕"
 
         # 得到频率字典
@@ -207,355 +619,744 @@ class Work(object):
         # 开始写入信息
 
         # 写入文件总字节数：
-        self.write_an_int2byte(file_size, output)
-
-        # 写入字符的叶子节点总个数
-        length = len(char_freq.keys())
-        self.write_an_int2byte(length, output)
-
-        # 开始写入 频率字典 解压缩用于重构hafuman树
-        for i in char_freq.keys():
-            output.write(six.int2byte(i))
-            self.write_an_int2byte(char_freq[i], output)
-
-        # 得到编码的字符频率字典
-        char_freq = self.get_encode_char_freq(char_freq)
-
-        # 算一下应该写入多少次 写入这个次数 解压时才能知道在哪截断
-        length_ = 0
-        code = ''
-        for x in range(file_size):
-            key = file_data[x]
-            code = code + char_freq[key]
-            while len(code) > 8:
-                code = code[8:]
-                length_ = length_ + 1
-        length_ = length_ + 1
-        write_an_int2byte(length_, output)
-
-        code = ''
-        for x in range(file_size):
-            key = file_data[x]
-            # 开始编码
-            code = code + char_freq[key]
-            # 如果长度大于8位 一个字节一个字节处理
-            while len(code) > 8:
-                out = int(code[0:8], 2)
-                code = code[8:]
-                output.write(six.int2byte(out))
-
-        # 写入最后的八位
-        code = code + (8 - len(code)) * '0'
-        out = int(code, 2)
-        output.write(six.int2byte(out))
+        write_varint(file_size, output)
+
+        # 只有一种字符 只写入这个字符
+        if len(char_freq) == 1:
+            output.write(six.int2byte(FILE_CONSTANT))
+            output.write(file_data[:1])
+            return '压缩完毕'
+
+        # 用字典的编码 只写编码字节数和编码
+        length_ = self.use_dictionary(char_freq, file_size)
+        if length_ >= 0:
+            output.write(six.int2byte(FILE_DICT))
+            write_varint(length_, output)
+            self.encode_data(file_data, self.dictionary.char_freq, output)
+            return '压缩完毕'
+
+        # 压缩不了就直接写入原文件
+        if self.use_stored(char_freq, file_size):
+            output.write(six.int2byte(FILE_STORED))
+            output.write(file_data)
+            return '压缩完毕'
+        output.write(six.int2byte(FILE_HUFFMAN))
+
+        # 只写入每个字符的编码长度 解压时直接由长度得到范式编码
+        # 频率一样的文件编码长度和编码字典也一样 从缓存里取
+        def build():
+            code_lengths = self.get_code_lengths(char_freq)
+            return code_lengths, self.get_canonical_char_freq(code_lengths)
+        freq_list = [0] * 256
+        for key in char_freq.keys():
+            freq_list[key] = char_freq[key]
+        code_lengths, char_freq = self.get_cached(b'F' + array.array('Q', freq_list).tobytes(), build)
+        self.write_code_lengths(code_lengths, output)
+
+        # 算一下应该写入多少字节 写入这个数 解压时才能知道在哪截断
+        # 由频率和编码长度直接算出 不用先把数据编码一遍
+        total_bits = 0
+        for key in code_lengths.keys():
+            total_bits = total_bits + freq_list[key] * code_lengths[key]
+        length_ = (total_bits + 7) // 8
+        write_varint(length_, output)
+
+        # 开始写入文件数据
+        self.encode_data(file_data, char_freq, output)
 
         return '压缩完毕'
 
-    def file_decompress(self, start, file_data, file_name):
+    def skip_file(self, start, file_data, version=FORMAT_LEGACY):
+        """
+        不解码 只由头部记录的字节数算出一个文件在压缩文件里的结束位置
+        :param start:
+        :param file_data:
+        :param version:
+        :return: 结束位置
+        """
+        total_byte, start = read_size(start, file_data, version)
+        if total_byte == 0:
+            return start
+
+        mode = FILE_HUFFMAN
+        if version >= FORMAT_STORED:
+            mode = file_data[start]
+            start = start + 1
+            if mode == FILE_STORED:
+                return start + total_byte
+            if mode == FILE_CONSTANT:
+                return start + 1
+
+        # 跳过编码表 字典的编码没有编码表
+        if mode == FILE_DICT:
+            pass
+        elif version == FORMAT_LEGACY:
+            start = start + 4 + get_an_int2byte(start, file_data) * 5
+        else:
+            start = self.read_code_lengths(start, file_data)[1]
+
+        file_end, start = read_size(start, file_data, version)
+        return start + file_end
+
+    def file_decompress(self, start, file_data, file_name, version=FORMAT_LEGACY):
         output = open(file_name, 'wb')
 
         # 得到文件的总字节数
-        total_byte_code = ''
-        for i in range(start, start + 4):
-            tmp = bin(file_data[i])[2:]
-            total_byte_code = total_byte_code + (8 - len(tmp)) * '0' + tmp
-        total_byte = int(total_byte_code, 2)
+        total_byte, start = read_size(start, file_data, version)
 
         if total_byte == 0:
-            # 如果文件为空文件 关闭文件 计算并返回结尾位置。
-            end = start + 4
+            # 如果文件为空文件 关闭文件 返回结尾位置。
             output.close()
-            return end
-
-        start = start + 4
-
-        # 得到叶子节点的个数
-        the_code = ''
-        for i in range(start, start + 4):
-            tmp = bin(file_data[i])[2:]
-            the_code = the_code + (8 - len(tmp)) * '0' + tmp
-        leaf_nodes = int(the_code, 2)
+            return start
+
+        if version >= FORMAT_STORED:
+            # 存储方式
+            mode = file_data[start]
+            start = start + 1
+            if mode == FILE_STORED:
+                # 原文件 直接写出
+                output.write(file_data[start:start + total_byte])
+                output.close()
+                return start + total_byte
+            if mode == FILE_CONSTANT:
+                output.write(file_data[start:start + 1] * total_byte)
+                output.close()
+                return start + 1
+        else:
+            mode = FILE_HUFFMAN
+
+        if mode == FILE_DICT:
+            # 字典的编码 查找表也用字典建好的
+            char_freq = self.dictionary.char_freq
+            decode_table = self.dictionary.get_decode_table()
+        elif version == FORMAT_LEGACY:
+            # 旧格式: 得到叶子节点的个数
+            leaf_nodes = get_an_int2byte(start, file_data)
+            head = start
+            start = start + 4 + leaf_nodes * 5
+
+            def build():
+                # 得到 字符频率字典
+                char_freq = {}
+                for i in range(leaf_nodes):
+                    key = file_data[head + 4 + i * 5 + 0]
+                    char_freq[key] = get_an_int2byte(head + 4 + i * 5 + 1, file_data)
+
+                # 得到编码字符频率字典
+                char_freq = self.get_encode_char_freq(char_freq)
+                return char_freq, self.build_decode_table(char_freq)
+            # 频率表一样的文件不用再建树 从缓存里取
+            char_freq, decode_table = self.get_cached(b'L' + file_data[head:start], build)
+        else:
+            # 范式哈弗曼: 由编码长度直接得到编码字典
+            head = start
+            code_lengths, start = self.read_code_lengths(start, file_data)
 
-        start = start + 4
+            def build():
+                char_freq = self.get_canonical_char_freq(code_lengths)
+                return char_freq, self.build_decode_table(char_freq)
+            # 编码长度表一样的文件不用再建查找表 从缓存里取
+            char_freq, decode_table = self.get_cached(b'C' + file_data[head:start], build)
 
-        # 得到 字符频率字典
-        char_freq = {}
-        for i in range(leaf_nodes):
-            key = file_data[start + i * 5 + 0]
-            freq_code = ''
-            for j in range(1, 5):
-                tmp = bin(file_data[start + i * 5 + j])[2:]
-                freq_code = freq_code + (8 - len(tmp)) * '0' + tmp
-            the_value = int(freq_code, 2)
-            char_freq[key] = the_value
-
-        start = start + leaf_nodes * 5
-
-        # 得到编码字符频率字典
-        char_freq = self.get_encode_char_freq(char_freq)
-        # 得到翻转后编码频率数组
-        reverse_char_freq = self.reverse_dict(char_freq)
-        file_end = get_an_int2byte(start, file_data)
+        file_end, start = read_size(start, file_data, version)
 
         # 得到文件结束位置
-        end = start + 4 + file_end
-
-        # 开始根据编码解压缩
-        # 把开头字符总数 频率字典的长度去除
-        code = ''
-        tmp_code = ''
-        tmp_byte = 0  # 存放已经翻译好的字节数
-        reverse_char_freq_keys = reverse_char_freq.keys()
-        for x in range(start + 4, end):
-
-            # 一个字节一个字节读取信息
-            one_char = file_data[x]
-            str_code = bin(one_char)[2:]
-            str_code = (8 - len(str_code)) * '0' + str_code
-            code = code + str_code
-
-            # 只有一个字符的话 有bug 两个字符以上无bug
-            while True:
-                if tmp_byte == total_byte:
-                    break
-                # 一个字符一个字符读取
-                tmp_code = tmp_code + code[0]
-                code = code[1:]
-
-                # 得到临时字符串如果在翻转后的编码频率的键值中 那么把键对应的值写入
-                if tmp_code in reverse_char_freq_keys:
-                    tmp_byte = tmp_byte + 1
-                    char_value = reverse_char_freq[tmp_code]
-                    output.write(six.int2byte(char_value))
-                    tmp_code = ''
-
-                if len(code) == 0:
-                    # code 长度为0 说明读取完毕了 跳出继续读取 补充code
-                    break
+        end = start + file_end
+
+        # 查表解码 一次写入
+        output.write(self.decode_data(file_data, start, end, total_byte, char_freq, decode_table))
         # 关闭文件
         output.close()
         return end
 
 
-def get_files(path, cla_folder_list=[]):
+def walk_files(path, skip=None):
     """
-    给我文件夹路径 我能得到建立 得到文件夹下的文件和 目录 返回Folder类对象的列表
+    不递归 用 os.scandir 一层一层地遍历文件夹 边遍历边返回 (路径, 是否是文件夹, 文件字节数)
+    文件夹总在它下面的文件和文件夹之前返回 类型和字节数用 DirEntry 里的信息 不用再对每个路径调用 isfile isdir
     :param path:
-    :param cla_folder_list:
+    :param skip: 不返回的文件的 (st_dev, st_ino) 压缩文件就在要压缩的文件夹里时 用来跳过它自己
     :return:
     """
-    folder = Folder(path)
-    cla_folder_list.append(folder)
-    files = os.listdir(path)
-    # print(files)
-    for file in files:
-        true_path = path + '/' + file
-        if os.path.isfile(true_path):
-            folder.file_list.append(true_path)
-
-        elif os.path.isdir(true_path):
-            folder.folder_list.append(true_path)
-            get_files(true_path, cla_folder_list)
+    yield path, True, 0
+    stack = [path]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                true_path = folder + '/' + entry.name
+                if entry.is_dir():
+                    yield true_path, True, 0
+                    stack.append(true_path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    if (stat.st_dev, stat.st_ino) == skip:
+                        continue
+                    yield true_path, False, stat.st_size
 
 
 def write_an_int2byte(num_int, output):
     """
-    给一个 int类型数， 给一个文件流 一个字节一个字节的写入
+    给一个 int类型数， 给一个文件流 写入4个字节 (大端)
     """
-    tmp = bin(num_int)[2:]
-    tmp = (32 - len(tmp)) * '0' + tmp
-    for i in range(0, 4):
-        code_tmp = int(tmp[i * 8:i * 8 + 8], 2)
-        output.write(six.int2byte(code_tmp))
+    output.write(struct.pack('>I', num_int))
 
 
 def get_an_int2byte(start, file_data):
     # 得到原始文件字节总数
-    the_code = ''
-    for i in range(start, start + 4):
-        tmp = bin(file_data[i])[2:]
-        the_code = the_code + (8 - len(tmp)) * '0' + tmp
-    return int(the_code, 2)
+    return int.from_bytes(file_data[start:start + 4], 'big')
 
 
-# 写如根path  写文件夹的名称 写入文件个数  写入文件名称  写入文件 写入文件在压缩文件占了多少个字节
-def folder_compress(path, folder_path, file_list, output_file_name):
+def write_varint(num_int, output):
+    """
+    写入变长整数: 从低位开始每7位一个字节 最高位为1表示后面还有字节
+    """
+    data = bytearray()
+    while num_int >= 0x80:
+        data.append((num_int & 0x7f) | 0x80)
+        num_int = num_int >> 7
+    data.append(num_int)
+    output.write(data)
+
+
+def get_varint(start, file_data):
+    """
+    从 start 开始读取一个变长整数 返回数和结束的位置
+    """
+    num_int = 0
+    shift = 0
+    while True:
+        if start >= len(file_data):
+            raise ValueError("压缩文件已损坏")
+        byte = file_data[start]
+        start = start + 1
+        num_int = num_int | ((byte & 0x7f) << shift)
+        if byte < 0x80:
+            return num_int, start
+        shift = shift + 7
+
+
+def read_size(start, file_data, version):
+    """
+    读取一个长度或个数 FORMAT_VARINT 开始是变长整数 之前是4字节 返回数和结束的位置
+    """
+    if version >= FORMAT_VARINT:
+        return get_varint(start, file_data)
+    return get_an_int2byte(start, file_data), start + 4
+
+
+# 写如根path  再边遍历边写入每个文件夹和文件的记录 (类型 路径 文件数据) 最后写入目录
+def folder_compress(path, items, output_file_name, dictionary=None, workers=WORKERS):
     """
     写入思路就是下面写的 顺序
     :param path:
-    :param folder_path:
-    :param file_list:
+    :param items: (路径, 是否是文件夹, 文件字节数) 可以是 walk_files 返回的生成器
     :param output_file_name:
-    :return:
+    :param dictionary: 训练好的字典 没有时为 None
+    :param workers: 进程数 大于1时多进程压缩 按文件顺序写入
+    :return: 这次压缩用的编码表缓存
     """
 
-    # 写入 根路径的长度
     output = open(output_file_name, 'wb')
-    write_an_int2byte(len(bytes(path, 'utf8')), output)
+    # 写入格式标记和版本号
+    output.write(FOLDER_MAGIC + six.int2byte(FORMAT_STREAM))
+    # 写入字典编号 没用字典写0
+    write_an_int2byte(dictionary.dict_id if dictionary is not None else 0, output)
+
+    # 写入 根路径的长度
+    write_varint(len(bytes(path, 'utf8')), output)
     # path_byte = struct.pack('i',path)
 
     # 写入根路径的名称
     output.write(bytes(path, 'utf8'))
 
-    # 写入根路径下文件夹和文件的个数
-    write_an_int2byte(len(folder_path), output)
-    write_an_int2byte(len(file_list), output)
-
-    for folder in folder_path:
-        # 写入文件夹列表的个数 和名称
-        write_an_int2byte(len(bytes(folder, 'utf8')), output)
-        output.write(bytes(folder, 'utf8'))
-
-    for file in file_list:
-        # 写入文件列表的长度和名称
-        write_an_int2byte(len(bytes(file, 'utf8')), output)
-        output.write(bytes(file, 'utf8'))
-
-    for file in file_list:
-        # haffuman_compress()
-        # 写入文件
-        tmp = Work(file, output_file_name, '', output)
-        # 调用单文件压缩
-        tmp.haffuman_compress
+    # 所有文件共用一个编码表缓存
+    table_cache = TableCache()
+    # 目录: 每个文件和文件夹的 (开始位置, 压缩后字节数, 原字节数, 路径) 文件夹是 (0, 0, 0, 路径)
+    # 先写到临时文件 文件再多也不占内存
+    index = tempfile.TemporaryFile()
+    if workers <= 1:
+        for name, is_dir, size in items:
+            write_entry(name, is_dir, output)
+            if is_dir:
+                write_index_entry(name, 0, 0, 0, index)
+            else:
+                # 写入文件
+                offset = output.tell()
+                tmp = Work(name, output_file_name, '', output, dictionary, table_cache)
+                # 调用单文件压缩
+                tmp.haffuman_compress
+                write_index_entry(name, offset, output.tell() - offset, size, index)
+    else:
+        # 边遍历边按顺序分批 每批交给一个子进程压缩
+        # 最多同时有 workers * 2 批在压缩或等待写入 原文件加起来不超过 MAX_PENDING_SIZE 内存占用有上限
+        executor = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(dictionary,))
+        pending = deque()
+        pending_size = 0
+        batch = []
+        batch_size = 0
+        for item in items:
+            batch.append(item)
+            batch_size = batch_size + item[2]
+            if batch_size >= BATCH_SIZE or len(batch) >= BATCH_COUNT:
+                while pending and (len(pending) >= workers * 2 or pending_size + batch_size > MAX_PENDING_SIZE):
+                    batch_done, size_done, future = pending.popleft()
+                    pending_size = pending_size - size_done
+                    write_files(output, batch_done, future.result(), index, table_cache)
+                files = [(name, size) for name, is_dir, size in batch if not is_dir]
+                pending.append((batch, batch_size, executor.submit(compress_files, files)))
+                pending_size = pending_size + batch_size
+                batch = []
+                batch_size = 0
+        if batch:
+            files = [(name, size) for name, is_dir, size in batch if not is_dir]
+            pending.append((batch, batch_size, executor.submit(compress_files, files)))
+        while pending:
+            batch_done, size_done, future = pending.popleft()
+            write_files(output, batch_done, future.result(), index, table_cache)
+        executor.shutdown()
+    output.write(six.int2byte(ENTRY_END))
+
+    # 最后写入目录 和目录开始的位置
+    index_start = output.tell()
+    index.seek(0)
+    shutil.copyfileobj(index, output)
+    index.close()
+    output.write(struct.pack('>Q', index_start) + INDEX_MAGIC)
 
     output.close()
+    return table_cache
+
+
+def write_entry(name, is_dir, output):
+    """
+    写入一条记录的类型和路径 文件的数据紧跟在后面
+    """
+    output.write(six.int2byte(ENTRY_FOLDER if is_dir else ENTRY_FILE))
+    write_varint(len(bytes(name, 'utf8')), output)
+    output.write(bytes(name, 'utf8'))
+
+
+def write_index_entry(name, offset, length_, size, index):
+    """
+    写入一个文件的目录项
+    """
+    for num_int in (offset, length_, size):
+        write_varint(num_int, index)
+    write_varint(len(bytes(name, 'utf8')), index)
+    index.write(bytes(name, 'utf8'))
+
+
+# 子进程里的字典和编码表缓存 由 init_worker 设置 同一个子进程压缩的文件共用
+worker_dictionary = None
+worker_cache = None
+
+
+def init_worker(dictionary):
+    """
+    子进程启动时调用一次 字典只传一次
+    """
+    global worker_dictionary, worker_cache
+    worker_dictionary = dictionary
+    worker_cache = TableCache()
+
+
+def compress_files(files):
+    """
+    在子进程中压缩一批文件 不小于 SPOOL_SIZE 的文件压缩到临时文件里 不经过进程间传递
+    :param files: [(文件名, 字节数)]
+    :return: 每个文件压缩后的 bytes 或临时文件名 的列表, 这批文件的缓存命中次数, 未命中次数
+    """
+    hits = worker_cache.hits
+    misses = worker_cache.misses
+    results = []
+    for file, size in files:
+        if size >= SPOOL_SIZE:
+            output = tempfile.NamedTemporaryFile(delete=False)
+        else:
+            output = io.BytesIO()
+        tmp = Work(file, '', '', output, worker_dictionary, worker_cache)
+        tmp.haffuman_compress
+        if size >= SPOOL_SIZE:
+            output.close()
+            results.append(output.name)
+        else:
+            results.append(output.getvalue())
+    return results, worker_cache.hits - hits, worker_cache.misses - misses
 
 
-def compress(path, output):
+def decompress_files(input_file, version, batch):
     """
-    压缩一个文件夹
+    在子进程中解压一批文件 每个文件只读它自己的字节
+    :param input_file: 压缩文件名
+    :param version:
+    :param batch: [(文件名, 开始位置, 结束位置)]
+    :return: 这批文件的缓存命中次数, 未命中次数
+    """
+    hits = worker_cache.hits
+    misses = worker_cache.misses
+    f = open(input_file, 'rb')
+    for file, start, end in batch:
+        f.seek(start)
+        tmp = Work('', '', '', '', worker_dictionary, worker_cache)
+        tmp.file_decompress(0, f.read(end - start), file, version)
+    f.close()
+    return worker_cache.hits - hits, worker_cache.misses - misses
+
+
+def write_files(output, batch, result, index, table_cache):
+    """
+    把子进程压缩好的一批文件和其中的文件夹按顺序写入 记下目录项 累加缓存命中次数
+    """
+    results, hits, misses = result
+    results = iter(results)
+    for name, is_dir, size in batch:
+        write_entry(name, is_dir, output)
+        if is_dir:
+            write_index_entry(name, 0, 0, 0, index)
+        else:
+            data = next(results)
+            if isinstance(data, str):
+                # 压缩到了临时文件里 复制过来再删掉
+                write_index_entry(name, output.tell(), os.path.getsize(data), size, index)
+                spool = open(data, 'rb')
+                shutil.copyfileobj(spool, output)
+                spool.close()
+                os.remove(data)
+            else:
+                write_index_entry(name, output.tell(), len(data), size, index)
+                output.write(data)
+    table_cache.hits = table_cache.hits + hits
+    table_cache.misses = table_cache.misses + misses
+
+
+def compress(path, output, dictionary=None, workers=WORKERS):
+    """
+    压缩一个文件夹 边遍历边压缩 不用先得到所有文件夹和文件
     :param path: 文件夹的路径
     :param output: 输出的文件名
+    :param dictionary: 训练好的字典 没有时为 None
+    :param workers: 进程数
     :return:
     """
-    cla_folder_list = []
-    folder_names = []
-    # print(path)
-    # get_files 只能获得给定path下所有的文件夹和文件 本身并不能包含自身（path）根路径
-    get_files(path, cla_folder_list)
-    for i in cla_folder_list:
-        if len(i.folder_list) > 0:
-            for folder_name in i.folder_list:
-                # 得到所有文件夹的名称
-                # folder_name = '.' + folder_name[len(path):]
-                # print(folder_name)
-                folder_names.append(folder_name)
+    # 压缩文件可能就在要压缩的文件夹里 边遍历边写入时会把自己也压进去 先建好它 遍历时跳过
+    open(output, 'wb').close()
+    stat = os.stat(output)
+    table_cache = folder_compress(path, walk_files(path, (stat.st_dev, stat.st_ino)), output, dictionary, workers)
+    return "压缩完毕 " + table_cache.get_message()
+
 
+def train(paths, output_file_name):
+    """
+    由样本文件 (或文件夹下的所有文件) 统计频率 建一个共用的编码表 写入字典文件
+    每个字节至少记1次 样本里没有的字节也有编码
+    字典编号是编码长度表的 crc32 (不为0)
+    :param paths: 样本文件或文件夹的列表
+    :param output_file_name: 字典文件名
+    :return:
+    """
     file_names = []
-    for i in cla_folder_list:
-        if len(i.file_list) > 0:
-            # print(i.file_list)
-            for file_name in i.file_list:
-                # 这个可以切掉
-                # file_name = '.' + file_name[len(path):]
-                file_names.append(file_name)
-    # get_files 只能获得给定path下所有的文件夹和文件 本身并不能包含自身（path）根路径 在folder_names 前面填上根路径
-    # 在文件夹列表的头部追加根路径
-    folder_names.insert(0, path)
-    # print(path)
-    # print(folder_names, file_names)
-    folder_compress(path, folder_names, file_names, output)
-    return "压缩完毕"
-
-
-def get_files_folds(file_data, start, end):
+    for path in paths:
+        if os.path.isdir(path):
+            for name, is_dir, size in walk_files(path):
+                if not is_dir:
+                    file_names.append(name)
+        else:
+            file_names.append(path)
+
+    tmp = Work('', '', '')
+    freq_list = [1] * 256
+    for file_name in file_names:
+        f = open(file_name, 'rb')
+        while True:
+            chunk = f.read(FREQ_CHUNK_SIZE)
+            if not chunk:
+                break
+            tmp.count_bytes(chunk, freq_list)
+        f.close()
+
+    char_freq = {}
+    for i in range(256):
+        char_freq[i] = freq_list[i]
+    table = io.BytesIO()
+    tmp.write_code_lengths(tmp.get_code_lengths(char_freq), table)
+    dict_id = zlib.crc32(table.getvalue()) & 0xffffffff or 1
+
+    output = open(output_file_name, 'wb')
+    output.write(DICT_MAGIC)
+    write_an_int2byte(dict_id, output)
+    output.write(table.getvalue())
+    output.close()
+    return "训练完毕 字典编号 %d" % dict_id
+
+
+def load_dictionary(file_name):
+    """
+    读取字典文件
+    :param file_name:
+    :return: Dictionary 对象
+    """
+    f = open(file_name, 'rb')
+    file_data = f.read()
+    f.close()
+    if file_data[0:4] != DICT_MAGIC:
+        raise ValueError("不是字典文件")
+    code_lengths = Work('', '', '').read_code_lengths(8, file_data)[0]
+    return Dictionary(get_an_int2byte(4, file_data), code_lengths)
+
+
+def get_format_version(file_data):
+    """
+    判断压缩文件的格式版本 返回版本号和后面信息开始的位置
+    旧格式开头是根路径的长度 不会大到第一个字节是 0xff 新格式开头是 FOLDER_MAGIC 和不为0的版本号
+    """
+    if len(file_data) > 8 and file_data[0:4] == FOLDER_MAGIC and file_data[4] != FORMAT_LEGACY:
+        return file_data[4], 5
+    return FORMAT_LEGACY, 0
+
+
+def get_files_folds(file_data, start, version):
     # 得到文件或文件夹的长度
-    file_length = ''
-    for k in range(start, end):
-        tmp = bin(file_data[k])[2:]
-        file_length = file_length + (8 - len(tmp)) * '0' + tmp
-    file_length = int(file_length, 2)
+    file_length, end = read_size(start, file_data, version)
 
     # 得到文件或者文件夹的名字
-    file_name = b''
-    for j in range(end, end + file_length):
-        file_name = file_name + bytes([file_data[j]])
-    file_name = file_name.decode('utf8')
+    file_name = file_data[end:end + file_length].decode('utf8')
     # print(end+file_length)
     return file_name, end + file_length
 
 
-def decompress(path):
+def read_index(f):
     """
+    从压缩文件末尾读取目录 只读头部和目录 不读文件数据
+    :param f: 打开的压缩文件
+    :return: 版本号, 字典编号, 目录 [(路径, 开始位置, 压缩后字节数, 原字节数)] 没有目录的旧格式返回 None
+    """
+    head = f.read(9)
+    version = get_format_version(head)[0]
+    if version < FORMAT_INDEX:
+        return None
+    f.seek(-12, os.SEEK_END)
+    tail = f.read(12)
+    if tail[8:] != INDEX_MAGIC:
+        raise ValueError("压缩文件已损坏")
+    f.seek(struct.unpack('>Q', tail[:8])[0])
+    index_data = f.read()
+
+    entries = []
+    # 目录一直到最后12字节 FORMAT_STREAM 之前开头还有文件个数
+    start = 0
+    if version < FORMAT_STREAM:
+        start = get_varint(0, index_data)[1]
+    while start < len(index_data) - 12:
+        offset, start = get_varint(start, index_data)
+        length_, start = get_varint(start, index_data)
+        size, start = get_varint(start, index_data)
+        name, start = get_files_folds(index_data, start, version)
+        entries.append((name, offset, length_, size))
+    return version, get_an_int2byte(5, head), entries
+
+
+def list_files(path):
+    """
+    列出压缩文件里的文件 只读目录 文件夹后面加 /
     :param path:
     :return:
     """
-    length_int = 4
     f = open(path, 'rb')
-    file_data = f.read()
+    index = read_index(f)
+    f.close()
+    if index is None:
+        return "对不起 这个压缩文件没有目录 只能整个解压"
+    lines = []
+    for name, offset, length_, size in index[2]:
+        if length_ == 0:
+            lines.append("%12s %12s  %s/" % ('', '', name))
+        else:
+            lines.append("%12d %12d  %s" % (size, length_, name))
+    return "\n".join(lines)
 
-    # 得到根路径长度
-    total_byte_code = ''
-    for i in range(0, length_int):
-        tmp = bin(file_data[i])[2:]
-        total_byte_code = total_byte_code + (8 - len(tmp)) * '0' + tmp
-    total_byte = int(total_byte_code, 2)
-    # print(len(path))
-    # print(total_byte)
 
-    # 得到根路径名字
-    tmp_name = b''
-    for i in range(length_int, length_int + total_byte):
-        # tmp_name = ''
-        tmp_name = tmp_name + bytes([file_data[i]])
+def match_file(name, patterns):
+    """
+    路径等于某个 pattern 在某个 pattern 文件夹下 或者和某个通配符匹配
+    """
+    for pattern in patterns:
+        if name == pattern or name.startswith(pattern.rstrip('/') + '/') or fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
 
-    # print(tmp_name.decode('utf8'))
-    # tmp_name = tmp_name.decode('utf8')
-    # print(tmp_name)
 
+def extract(path, patterns, dictionary=None):
+    """
+    只解压路径和 patterns 匹配的文件和文件夹 由目录直接找到每个文件的位置 只读这些文件的数据
+    目录里有文件夹时 (FORMAT_STREAM) 匹配的空文件夹也会建出来
+    :param path:
+    :param patterns: 文件路径 文件夹路径 或通配符的列表
+    :param dictionary: 压缩时用的字典 没用字典时为 None
+    :return:
+    """
+    f = open(path, 'rb')
+    index = read_index(f)
+    if index is None:
+        f.close()
+        return "对不起 这个压缩文件没有目录 只能整个解压"
+    version, dict_id, entries = index
+    if dict_id != 0 and (dictionary is None or dictionary.dict_id != dict_id):
+        f.close()
+        return "对不起 需要编号为 %d 的字典" % dict_id
+
+    entries = [entry for entry in entries if match_file(entry[0], patterns)]
+    if not entries:
+        f.close()
+        return "对不起 没有匹配的文件"
+    for entry in entries:
+        if entry[2] != 0 and os.path.exists(entry[0]):
+            f.close()
+            return "对不起 解压文件已经存在"
+
+    table_cache = TableCache()
+    count = 0
+    for name, offset, length_, size in entries:
+        if length_ == 0:
+            # 文件夹
+            if not os.path.isdir(name):
+                os.makedirs(name)
+            continue
+        count = count + 1
+        folder = os.path.dirname(name)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        f.seek(offset)
+        tmp = Work('', '', '', '', dictionary, table_cache)
+        tmp.file_decompress(0, f.read(length_), name, version)
+    f.close()
+    return "解压完毕 %d 个文件 " % count + table_cache.get_message()
+
+
+def read_entries(file_data, start, version):
+    """
+    依次返回压缩文件里的文件夹和文件 (路径, 是否是文件夹, 文件开始位置, 结束位置)
+    文件的结束位置由记录的字节数算出 不用解码
+    :param file_data:
+    :param start: 根路径之后的位置
+    :param version:
+    :return:
+    """
+    tmp = Work('', '', '')
+    if version >= FORMAT_STREAM:
+        while file_data[start] != ENTRY_END:
+            is_dir = file_data[start] == ENTRY_FOLDER
+            name, start = get_files_folds(file_data, start + 1, version)
+            end = start if is_dir else tmp.skip_file(start, file_data, version)
+            yield name, is_dir, start, end
+            start = end
+        return
+
+    # 旧格式: 先是文件夹和文件的个数 所有文件夹的路径 所有文件的路径 然后是文件数据
     # 得到文件夹的个数
-    folder_length = ''
-    for j in range(length_int + total_byte, total_byte + length_int + length_int):
-        tmp = bin(file_data[j])[2:]
-        folder_length = folder_length + (8 - len(tmp)) * '0' + tmp
-    folder_length = int(folder_length, 2)
-    # print(folder_length)
+    folder_length, start = read_size(start, file_data, version)
 
     # 得到文件个数
-    file_length = ''
-    for k in range(total_byte + length_int + length_int, total_byte + 3 * length_int):
-        tmp = bin(file_data[k])[2:]
-        file_length = file_length + (8 - len(tmp)) * '0' + tmp
-    file_length = int(file_length, 2)
-    # print(file_length)
-
-    # 得到文件夹和文件的具体信息
-    all_folders = []
-    all_files = []
-    # 得到folderlist
-    start = total_byte + 3 * length_int
-    end = total_byte + 4 * length_int
+    file_length, start = read_size(start, file_data, version)
+
     for i in range(0, folder_length):
-        folder_name_end = get_files_folds(file_data, start, end)
-        folder_name = folder_name_end[0]
-        start = folder_name_end[1]
-        end = start + 4
-        all_folders.append(folder_name)
+        folder_name, start = get_files_folds(file_data, start, version)
+        yield folder_name, True, start, start
 
+    all_files = []
     for j in range(0, file_length):
-        file_name_end = get_files_folds(file_data, start, end)
-        file_name = file_name_end[0]
-        start = int(file_name_end[1])
-        end = start + 4
+        file_name, start = get_files_folds(file_data, start, version)
         all_files.append(file_name)
 
-    # print(all_files)
-    # print(all_folders)
+    for file_name in all_files:
+        end = tmp.skip_file(start, file_data, version)
+        yield file_name, False, start, end
+        start = end
 
-    # 创建目录
-    for folder in all_folders:
-        # folder = root + folder[1:]
-        if os.path.exists(folder):
-            return "对不起 解压文件夹已经存在"
-        os.makedirs(folder)
 
-    for file in all_files:
-        # 调用解压函数 解压每一个文件
-        tmp = Work('', '', '', '')
-        end = tmp.file_decompress(start, file_data, file)
-        start = end
+def decompress(path, dictionary=None, workers=WORKERS):
+    """
+    :param path:
+    :param dictionary: 压缩时用的字典 没用字典时为 None
+    :param workers: 进程数 大于1时多进程解压 解出的文件和一个进程时相同
+    :return:
+    """
+    f = open(path, 'rb')
+    if workers > 1:
+        # 多进程时主进程只要读每个文件的头部 文件数据由子进程自己读
+        # 把压缩文件映射到内存 用到哪一页才读哪一页 不把整个压缩文件读进来
+        file_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        file_data = f.read()
+    f.close()
+
+    # 判断格式版本 新格式的头部信息都在标记和版本号之后
+    version, head = get_format_version(file_data)
 
-    return "解压完毕"
+    if version >= FORMAT_DICT:
+        # 压缩时用了字典的话 要给同一个编号的字典
+        dict_id = get_an_int2byte(head, file_data)
+        head = head + 4
+        if dict_id != 0 and (dictionary is None or dictionary.dict_id != dict_id):
+            return "对不起 需要编号为 %d 的字典" % dict_id
+
+    # 得到根路径长度
+    total_byte, head = read_size(head, file_data, version)
+
+    # 得到根路径名字
+    tmp_name = file_data[head:head + total_byte]
+
+    # print(tmp_name.decode('utf8'))
+
+    # 文件夹总在它下面的文件之前 遇到文件夹就创建
+    entries = read_entries(file_data, head + total_byte, version)
+
+    # 所有文件共用一个编码表缓存
+    table_cache = TableCache()
+    if workers <= 1:
+        for name, is_dir, start, end in entries:
+            if is_dir:
+                # 创建目录
+                if os.path.exists(name):
+                    return "对不起 解压文件夹已经存在"
+                os.makedirs(name)
+            else:
+                # 调用解压函数 解压每一个文件
+                tmp = Work('', '', '', '', dictionary, table_cache)
+                tmp.file_decompress(start, file_data, name, version)
+    else:
+        # 文件按顺序分成几批 每批交给一个子进程解压
+        # 最多同时有 workers * 2 批在解压
+        executor = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(dictionary,))
+        pending = deque()
+        batch = []
+        batch_size = 0
+        for name, is_dir, start, end in entries:
+            if is_dir:
+                if os.path.exists(name):
+                    executor.shutdown()
+                    return "对不起 解压文件夹已经存在"
+                os.makedirs(name)
+                continue
+            batch.append((name, start, end))
+            batch_size = batch_size + end - start
+            if batch_size >= BATCH_SIZE or len(batch) >= BATCH_COUNT:
+                pending.append(executor.submit(decompress_files, path, version, batch))
+                batch = []
+                batch_size = 0
+                if len(pending) >= workers * 2:
+                    hits, misses = pending.popleft().result()
+                    table_cache.hits = table_cache.hits + hits
+                    table_cache.misses = table_cache.misses + misses
+        if batch:
+            pending.append(executor.submit(decompress_files, path, version, batch))
+        while pending:
+            hits, misses = pending.popleft().result()
+            table_cache.hits = table_cache.hits + hits
+            table_cache.misses = table_cache.misses + misses
+        executor.shutdown()
+
+    return "解压完毕 " + table_cache.get_message()
 
 
 class WorkThread(QThread):
@@ -705,8 +1506,59 @@ class HaffumanForm(QWidget, Ui_Form):
         self.lineEdit.clear()
 
 
+def main(argv):
+    """
+    命令行入口 不带参数时打开界面
+    :param argv:
+    :return:
+    """
+    parser = argparse.ArgumentParser(description="哈弗曼压缩文件夹 不带参数时打开界面")
+    subparsers = parser.add_subparsers(dest='command')
+
+    parser_train = subparsers.add_parser('train', help="由样本文件训练共用的编码表 写入字典文件")
+    parser_train.add_argument('output', help="字典文件名")
+    parser_train.add_argument('samples', nargs='+', help="样本文件或文件夹")
+
+    parser_compress = subparsers.add_parser('compress', help="压缩文件夹")
+    parser_compress.add_argument('input')
+    parser_compress.add_argument('output', nargs='?', help="默认为 文件夹名.folderbak")
+    parser_compress.add_argument('--dictionary', help="字典文件")
+    parser_compress.add_argument('--workers', type=int, default=WORKERS, help="进程数")
+
+    parser_decompress = subparsers.add_parser('decompress', help="解压到压缩时的路径")
+    parser_decompress.add_argument('input')
+    parser_decompress.add_argument('--dictionary', help="压缩时用的字典文件")
+    parser_decompress.add_argument('--workers', type=int, default=WORKERS, help="进程数")
+
+    parser_list = subparsers.add_parser('list', help="列出压缩文件里的文件 (原字节数 压缩后字节数 路径)")
+    parser_list.add_argument('input')
+
+    parser_extract = subparsers.add_parser('extract', help="只解压指定的文件 文件夹或和通配符匹配的文件")
+    parser_extract.add_argument('input')
+    parser_extract.add_argument('patterns', nargs='+', help="文件路径 文件夹路径 或通配符")
+    parser_extract.add_argument('--dictionary', help="压缩时用的字典文件")
+
+    args = parser.parse_args(argv)
+    if args.command == 'train':
+        print(train(args.samples, args.output))
+    elif args.command == 'compress':
+        dictionary = load_dictionary(args.dictionary) if args.dictionary else None
+        print(compress(args.input, args.output or args.input.rstrip('/') + '.folderbak', dictionary, args.workers))
+    elif args.command == 'decompress':
+        dictionary = load_dictionary(args.dictionary) if args.dictionary else None
+        print(decompress(args.input, dictionary, args.workers))
+    elif args.command == 'list':
+        print(list_files(args.input))
+    elif args.command == 'extract':
+        dictionary = load_dictionary(args.dictionary) if args.dictionary else None
+        print(extract(args.input, args.patterns, dictionary))
+    else:
+        app = QApplication(sys.argv)
+        My_win = HaffumanForm()
+        My_win.show()
+        return app.exec_()
+    return 0
+
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    My_win = HaffumanForm()
-    My_win.show()
-    sys.exit(app.exec_())
+    sys.exit(main(sys.argv[1:]))
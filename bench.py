@@ -0,0 +1,313 @@
+"""
+压缩和解压的速度测试 结果同时写到 bench_output.txt
+用法:
+    python bench.py [部分 ...] [--size 每个样本的MB数] [--repeat 次数] [--workers 1,2,4]
+"""
+import argparse
+import filecmp
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import FileHuff
+import FolderHuff
+
+# 每个样本默认的字节数
+BENCH_SIZE = 8 << 20
+
+# 每项默认测几次 取最快的一次
+REPEAT = 3
+
+# 结果文件
+OUTPUT_FILE = 'bench_output.txt'
+
+
+def make_samples(size):
+    """
+    生成测试数据: 源代码文本 / 随机字节 / 分布很偏的字节
+    :param size:
+    :return: {名字: bytes}
+    """
+    rand = random.Random(1)
+    text = b''
+    for name in ('FileHuff.py', 'FolderHuff.py', 'README.md'):
+        f = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb')
+        text = text + f.read()
+        f.close()
+    skew = bytearray(size)
+    for i in range(size):
+        skew[i] = min(255, int(rand.expovariate(0.05)))
+    return {
+        'text': (text * (size // len(text) + 1))[:size],
+        'random': os.urandom(size),
+        'skew': bytes(skew),
+    }
+
+
+def best_time(func, repeat, setup=None):
+    """
+    调用 func repeat 次 返回最短的秒数 setup 在每次调用前执行 不计时
+    """
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        used = time.perf_counter() - start
+        if best is None or used < best:
+            best = used
+    return best
+
+
+def make_tree(path, samples):
+    """
+    用样本数据建一个有很多小文件 几个大文件 还有空文件夹的目录
+    :return: 所有文件的总字节数
+    """
+    rand = random.Random(2)
+    total = 0
+    for name, data in samples.items():
+        os.makedirs(os.path.join(path, name, 'empty'))
+        # 一个大文件 压缩时要先写到临时文件
+        big = len(data) // 2
+        f = open(os.path.join(path, name, 'big'), 'wb')
+        f.write(data[:big])
+        f.close()
+        # 剩下的切成 1KB 到 64KB 的小文件 每个子文件夹放 100 个
+        start = big
+        count = 0
+        while start < len(data):
+            size = rand.randint(1 << 10, 1 << 16)
+            folder = os.path.join(path, name, 'd%d' % (count // 100))
+            if count % 100 == 0:
+                os.mkdir(folder)
+            f = open(os.path.join(folder, 'f%d' % count), 'wb')
+            f.write(data[start:start + size])
+            f.close()
+            start = start + size
+            count = count + 1
+        total = total + len(data)
+    return total
+
+
+def same_tree(a, b):
+    """
+    比较两个目录里的文件夹和文件是否完全相同
+    """
+    names_a = []
+    for root, dirs, files in os.walk(a):
+        for name in dirs + files:
+            names_a.append(os.path.relpath(os.path.join(root, name), a))
+    names_b = []
+    for root, dirs, files in os.walk(b):
+        for name in dirs + files:
+            names_b.append(os.path.relpath(os.path.join(root, name), b))
+    if sorted(names_a) != sorted(names_b):
+        return False
+    for name in names_a:
+        if os.path.isfile(os.path.join(a, name)) and \
+                not filecmp.cmp(os.path.join(a, name), os.path.join(b, name), shallow=False):
+            return False
+    return True
+
+
+def workers_list(text):
+    """
+    解析 --workers 参数: 逗号分隔的进程数
+    """
+    try:
+        workers = [int(x) for x in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("进程数要用逗号分隔的整数: " + text)
+    if not workers or min(workers) < 1:
+        raise argparse.ArgumentTypeError("进程数至少是1: " + text)
+    return workers
+
+
+def default_workers():
+    """
+    默认的进程数: 1 2 4 8 ... 直到 CPU 个数
+    """
+    cpu = os.cpu_count() or 1
+    workers = [1]
+    while workers[-1] * 2 < cpu:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != cpu:
+        workers.append(cpu)
+    return workers
+
+
+def report(line, output):
+    print(line)
+    output.write(line + '\n')
+    output.flush()
+
+
+def legacy_freq_dict(file_data, file_size):
+    """
+    原来的 get_freq_dict: 逐字节判断是否在字典里 作为对比
+    """
+    char_freq = {}
+    for i in range(file_size):
+        char_value = file_data[i]
+        if char_value in char_freq.keys():
+            char_freq[char_value] = char_freq[char_value] + 1
+        else:
+            char_freq[char_value] = 1
+
+    return char_freq
+
+
+def bench_freq(samples, args, output):
+    """
+    统计频率: 原来的逐字节循环 / 标准库 Counter / numpy bincount (FileHuff 和 FolderHuff 各测一次)
+    """
+    numpy = FileHuff.numpy
+    for name, data in samples.items():
+        size = len(data)
+        # 原来的循环太慢 只测1MB
+        part = data[:1 << 20]
+        used = best_time(lambda: legacy_freq_dict(part, len(part)), 1)
+        report("freq    %-7s 原来的逐字节循环        %8.1f MB/s" % (name, len(part) / used / 1e6), output)
+        for module in (FileHuff, FolderHuff):
+            work = module.Work('', '', '')
+            engines = [('Counter', None)]
+            if numpy is not None:
+                engines.append(('numpy', numpy))
+            for engine, value in engines:
+                module.numpy = value
+                used = best_time(lambda: work.get_freq_dict(data, size), args.repeat)
+                report("freq    %-7s %-11s %-10s %8.1f MB/s" % (name, module.__name__, engine, size / used / 1e6),
+                       output)
+            module.numpy = numpy
+
+
+def bench_encode(samples, args, output):
+    """
+    编码: numpy 批量编码 / 纯 Python 位缓冲 两种输出必须逐字节相同
+    """
+    for name, data in samples.items():
+        size = len(data)
+        for module in (FileHuff, FolderHuff):
+            work = module.Work('', '', '')
+            char_freq = work.get_canonical_char_freq(work.get_code_lengths(work.get_freq_dict(data, size)))
+            # FileHuff 的编码函数要的是数据块的列表
+            chunks = [data] if module is FileHuff else data
+            engines = [('python', work.encode_data_python)]
+            if module.numpy is not None:
+                engines.append(('numpy', work.encode_data_numpy))
+            results = []
+            for engine, encode in engines:
+                used = best_time(lambda: encode(chunks, char_freq, io.BytesIO()), args.repeat)
+                out = io.BytesIO()
+                encode(chunks, char_freq, out)
+                results.append(out.getvalue())
+                report("encode  %-7s %-11s %-10s %8.1f MB/s" % (name, module.__name__, engine, size / used / 1e6),
+                       output)
+            if results[-1] != results[0]:
+                raise AssertionError("%s %s: numpy 和 python 编码结果不同" % (name, module.__name__))
+
+
+def bench_blocks(samples, args, output):
+    """
+    分块压缩和解压: 每个进程数各测一次 加速比都和第一个进程数比
+    """
+    for name, data in samples.items():
+        size = len(data)
+        input_file = os.path.join(args.tmp, name)
+        compressed = input_file + '.huff'
+        restored = input_file + '.out'
+        f = open(input_file, 'wb')
+        f.write(data)
+        f.close()
+        base = None
+        for workers in args.workers:
+            work = FileHuff.Work(input_file, compressed, workers=workers)
+            compress_time = best_time(work.haffuman_compress, args.repeat)
+            work = FileHuff.Work(compressed, restored, workers=workers)
+            decompress_time = best_time(work.haffuman_decompress, args.repeat)
+            if not filecmp.cmp(input_file, restored, shallow=False):
+                raise AssertionError("%s: %d 个进程解压的结果和原文件不同" % (name, workers))
+            if base is None:
+                base = (compress_time, decompress_time)
+            report("blocks  %-7s 进程 %-3d 压缩 %8.1f MB/s (%4.2fx)  解压 %8.1f MB/s (%4.2fx)  压缩率 %5.1f%%" % (
+                name, workers, size / compress_time / 1e6, base[0] / compress_time,
+                size / decompress_time / 1e6, base[1] / decompress_time,
+                os.path.getsize(compressed) * 100.0 / size), output)
+        for file_name in (input_file, compressed, restored):
+            os.remove(file_name)
+
+
+def bench_folder(samples, args, output):
+    """
+    文件夹压缩和解压: 每个进程数各测一次 加速比都和第一个进程数比
+    压缩包里记的是相对路径 在临时目录里压缩 解压
+    """
+    cwd = os.getcwd()
+    os.chdir(args.tmp)
+    try:
+        total = make_tree('tree', samples)
+        os.rename('tree', 'tree.orig')
+        base = None
+        for workers in args.workers:
+            os.rename('tree.orig', 'tree')
+            compress_time = best_time(lambda: FolderHuff.compress('tree', 'tree.folderhuff', workers=workers),
+                                      args.repeat)
+            os.rename('tree', 'tree.orig')
+            decompress_time = best_time(lambda: FolderHuff.decompress('tree.folderhuff', workers=workers),
+                                        args.repeat, lambda: shutil.rmtree('tree', ignore_errors=True))
+            if not same_tree('tree.orig', 'tree'):
+                raise AssertionError("%d 个进程解压的结果和原目录不同" % workers)
+            shutil.rmtree('tree')
+            if base is None:
+                base = (compress_time, decompress_time)
+            report("folder  进程 %-3d 压缩 %8.1f MB/s (%4.2fx)  解压 %8.1f MB/s (%4.2fx)  压缩率 %5.1f%%" % (
+                workers, total / compress_time / 1e6, base[0] / compress_time,
+                total / decompress_time / 1e6, base[1] / decompress_time,
+                os.path.getsize('tree.folderhuff') * 100.0 / total), output)
+    finally:
+        os.chdir(cwd)
+
+
+# 可以单独测的部分
+SECTIONS = {
+    'freq': bench_freq,
+    'encode': bench_encode,
+    'blocks': bench_blocks,
+    'folder': bench_folder,
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="压缩和解压的速度测试 结果同时写到 " + OUTPUT_FILE)
+    parser.add_argument('sections', nargs='*', help="要测的部分 (%s) 默认全部" % ' '.join(SECTIONS))
+    parser.add_argument('--size', type=float, default=BENCH_SIZE / (1 << 20), help="每个样本的MB数")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="每项测几次 取最快的一次")
+    parser.add_argument('--workers', type=workers_list, default=default_workers(),
+                        help="逗号分隔的进程数 例如 1,2,4 默认从1翻倍到 CPU 个数")
+    args = parser.parse_args(argv)
+    for section in args.sections:
+        if section not in SECTIONS:
+            parser.error("没有这一部分: " + section)
+
+    samples = make_samples(int(args.size * (1 << 20)))
+    args.tmp = tempfile.mkdtemp()
+    output = open(OUTPUT_FILE, 'w')
+    report("python %s  numpy %s  cpu %d" % (sys.version.split()[0], 'yes' if FileHuff.numpy is not None else 'no',
+                                            os.cpu_count() or 1), output)
+    try:
+        for section in args.sections or list(SECTIONS):
+            SECTIONS[section](samples, args, output)
+    finally:
+        output.close()
+        shutil.rmtree(args.tmp)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))